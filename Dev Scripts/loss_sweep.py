@@ -0,0 +1,39 @@
+import os
+import sys
+import chess.pgn
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '../Objects'))
+from Sweeper import Sweeper
+from Utilities import Utility
+
+if __name__ == "__main__":
+    print("Starting script...")
+
+    # PGN file with the test games, the number of them to sweep and the number of worker processes
+    pgn_path  = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.realpath(__file__)), '../Games/demo.pgn')
+    n_games   = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    n_workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+
+    print(f"Reading up to {n_games} test games from {pgn_path}...")
+    games = []
+    with open(pgn_path, "r") as pgn_file:
+        while len(games) < n_games and (game := chess.pgn.read_game(pgn_file)) is not None:
+            games.append(str(game))
+
+    sweeper = Sweeper(Utility(), n_workers = n_workers)
+    grid    = len(sweeper.preferences) * len(sweeper.lambdas) * len(sweeper.depths)
+
+    print(f"Sweeping {grid} grid points over {len(games)} games with {n_workers} workers...")
+    results = sweeper(games, is_file = False)
+
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(results.to_string(index = False, float_format = '{:.3f}'.format))
+
+    print("\nSeconds per stage, summed over workers:")
+    for stage, seconds in sweeper.timings.items():
+        print(f"  {stage:<8} {seconds:>10.2f}")
+
+    results_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'loss_sweep.csv')
+    results.to_csv(results_path, index = False)
+    print(f"\nResults saved to {results_path}")
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import chess.pgn
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '../Objects'))
+from Position import Position
+from Replayer import Replayer
+
+print("Starting script...")
+
+# PGN file with one or more games, defaulting to the demo game
+pgn_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.realpath(__file__)), '../Games/demo.pgn')
+repeats  = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+print(f"Reading games from {pgn_path}...")
+games = []
+with open(pgn_path, "r") as pgn_file:
+    while (game := chess.pgn.read_game(pgn_file)) is not None:
+        games.append(game)
+
+uci_games     = [[move.uci() for move in game.mainline_moves()] for game in games]
+encoded_games = [[Replayer.encode(move) for move in moves] for moves in uci_games]
+positions     = sum(len(moves) + 1 for moves in uci_games) * repeats
+
+def python_chess_path(game: chess.pgn.Game) -> np.ndarray:
+    '''
+    The path ingestion has used so far: push each move onto a python-chess Board and rescan it with get_bitboards.
+    '''
+
+    board = game.board()
+    sums  = [sum(Position.get_bitboards(board).values()) & 0xFFFFFFFFFFFFFFFF]
+
+    for move in game.mainline_moves():
+        board.push(move)
+        sums.append(sum(Position.get_bitboards(board).values()) & 0xFFFFFFFFFFFFFFFF)
+
+    return np.array(sums, dtype = np.uint64)
+
+print("Checking that both paths produce the same board sums...")
+for game, moves in zip(games, uci_games):
+    assert np.array_equal(python_chess_path(game), Replayer().replay(moves)[1]), f"Mismatch in {game.headers.get('Event', 'game')}"
+
+timings = {}
+
+start = time.perf_counter()
+for _ in range(repeats):
+    for game in games:
+        python_chess_path(game)
+timings["python-chess + get_bitboards"] = time.perf_counter() - start
+
+start = time.perf_counter()
+for _ in range(repeats):
+    for moves in uci_games:
+        Replayer().replay(moves)
+timings["Replayer (UCI)"] = time.perf_counter() - start
+
+start = time.perf_counter()
+for _ in range(repeats):
+    for moves in encoded_games:
+        Replayer().replay(moves)
+timings["Replayer (encoded)"] = time.perf_counter() - start
+
+print(f"\n{len(games)} games, {positions:,} positions per path\n")
+baseline = timings["python-chess + get_bitboards"]
+for name, seconds in timings.items():
+    print(f"  {name:<30} {positions / seconds:>12,.0f} positions/s  ({baseline / seconds:.1f}x)")
@@ -0,0 +1,298 @@
+from   Utilities import *
+from   typing    import *
+import numpy             as np
+import os
+import pandas            as pd
+import pyarrow           as pa
+import pyarrow.dataset   as ds
+
+class Aggregates:
+    '''
+    The Aggregates class precomputes, for every position in the dataset, what happened next: each move played from it,
+    how often, how those games ended, and how the centipawn value developed over the following plies. With this table,
+    scoring a position online is a binary search followed by a handful of vector operations, instead of gathering and
+    scoring every raw row that matches it.
+
+    A move is identified by the board_sum of the position it leads to, which is the edge the search follows anyway.
+    The final position of a game has no move after it and is kept as an entry with a null next_board_sum.
+
+    Attributes:
+        storage  (Utility)          : The Utility whose dataset is aggregated.
+        path     (str)              : The directory holding the aggregate segments and their manifest.
+        segments (List[pa.Table])   : The memory-mapped base segment, followed by one segment per ingested delta.
+        keys     (List[np.ndarray]) : The board_sum column of each segment, which every segment is sorted by.
+
+    Methods:
+        restamp  : Records the current dataset version in the manifest.
+        per_row  : Computes the outcome and forward centipawn means of every row in a frame of whole games.
+        partial  : Aggregates a frame of whole games into one row per position and move.
+        combine  : Merges aggregate rows for the same position and move, pooling their means and variances.
+        write    : Writes a segment as a sorted Arrow IPC file.
+        load     : Memory-maps every segment.
+        build    : Builds the base segment from the whole dataset, one Parquet fragment at a time.
+        append   : Adds a segment for a newly ingested delta.
+        compact  : Folds the delta segments into the base segment.
+        locate   : Returns the dataset row of each (game_id, ply) pair.
+        lookup   : Returns every move played from a position.
+
+    Columns:
+        board_sum, next_board_sum : The position and the position the move led to.
+        count                     : The number of times the move was played from the position.
+        wins, draws, losses       : The results of those games, from white's point of view.
+        n_{d}, mean_{d}, var_{d}  : For each supported depth d, the number of occurrences with a forward centipawn value,
+                                    and the mean and population variance of that value, where the forward centipawn value
+                                    of an occurrence is the mean evaluation of its next d plies in the same game.
+        game_id, ply, row         : One occurrence of the move, used to show an example game, and its row in the
+                                    concatenated dataset, so Dagger can read it with a single slice.
+
+    Pooling:
+        Two aggregates of the same move with counts n₁ and n₂ are merged with
+            n   = n₁ + n₂
+            μ   = (n₁μ₁ + n₂μ₂) / n
+            σ²  = (n₁(σ₁² + μ₁²) + n₂(σ₂² + μ₂²)) / n - μ²
+        which is exact, so the table built from a delta can be merged into the base without revisiting any raw rows.
+    '''
+
+    depths         = (5, 10, 20)
+    schema_version = 2
+
+    def __init__(self, storage: Utility):
+
+        self.storage = storage
+        self.path    = os.path.join(os.path.dirname(storage.pq_path), 'Aggregates', storage.pq_name)
+
+        manifest = self.storage.read_manifest(os.path.join(self.path, 'manifest.json'))
+        if (manifest.get("version"), manifest.get("schema_version")) != (storage.dataset_version(), self.schema_version):
+            self.build()
+
+        self.segments, self.keys = self.load()
+
+    def restamp(self):
+        '''
+        Records the current dataset version in the manifest. This is only correct once every game in the dataset is
+        covered by a segment, as it is after build, append and compact.
+        '''
+
+        self.storage.write_manifest(os.path.join(self.path, 'manifest.json'),
+                                    {"version"        : self.storage.dataset_version(),
+                                     "schema_version" : self.schema_version,
+                                     "depths"         : list(self.depths)})
+
+    @classmethod
+    def per_row(cls,
+                frame  : pd.DataFrame,
+                offset : int = 0) -> pd.DataFrame:
+        '''
+        Computes, for every row of a frame of whole games, the board_sum of the next ply, the result of the game and the
+        forward centipawn mean at each supported depth. The means come from prefix sums over each game, so the cost does
+        not grow with the depth. Missing evaluations are skipped rather than counted as zero.
+
+        offset is the number of dataset rows before the frame, so each row also records its row in the whole dataset.
+        '''
+
+        frame        = frame.reset_index(drop = True).sort_values(['game_id', 'ply'], kind = 'stable')
+        dataset_rows = offset + frame.index.to_numpy(dtype = np.int64)
+        frame        = frame.reset_index(drop = True)
+        game_ids     = frame['game_id'].to_numpy()
+        keys         = frame['board_sum'].to_numpy(dtype = np.uint64)
+        centipawn    = frame['centipawn_evaluation'].to_numpy(dtype = float, na_value = np.nan)
+        positions    = np.arange(len(frame))
+        game_ends    = Utility.game_ends(game_ids)
+
+        results = frame.drop_duplicates('game_id').set_index('game_id')['pgn'].str.extract(r'\[Result "([^"]+)"\]')[0]
+        result  = frame['game_id'].map(results)
+
+        rows = pd.DataFrame({"row"            : dataset_rows,
+                             "board_sum"      : keys,
+                             "next_board_sum" : pd.array(np.roll(keys, -1), dtype = "UInt64"),
+                             "win"            : (result == "1-0").to_numpy(dtype = np.int64),
+                             "draw"           : (result == "1/2-1/2").to_numpy(dtype = np.int64),
+                             "loss"           : (result == "0-1").to_numpy(dtype = np.int64),
+                             "game_id"        : game_ids,
+                             "ply"            : frame['ply'].to_numpy()})
+        rows.loc[positions + 1 >= game_ends, 'next_board_sum'] = pd.NA
+
+        values = np.r_[0, np.cumsum(np.nan_to_num(centipawn))]
+        valid  = np.r_[0, np.cumsum(~np.isnan(centipawn))]
+
+        for depth in cls.depths:
+            ends    = np.minimum(positions + depth, game_ends)
+            counted = valid[ends] - valid[positions]
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                rows[f'forward_{depth}'] = np.where(counted > 0, (values[ends] - values[positions]) / counted, np.nan)
+
+        return rows
+
+    @classmethod
+    def partial(cls,
+                frame  : pd.DataFrame,
+                offset : int = 0) -> pd.DataFrame:
+        '''
+        Aggregates a frame of whole games, starting offset rows into the dataset, into one row per position and move.
+        '''
+
+        rows    = cls.per_row(frame, offset)
+        grouped = rows.groupby(['board_sum', 'next_board_sum'], dropna = False, sort = False)
+
+        partial = grouped.agg(count   = ('win', 'size'),
+                              wins    = ('win', 'sum'),
+                              draws   = ('draw', 'sum'),
+                              losses  = ('loss', 'sum'),
+                              game_id = ('game_id', 'first'),
+                              ply     = ('ply', 'first'),
+                              row     = ('row', 'first'))
+
+        for depth in cls.depths:
+            forward                  = grouped[f'forward_{depth}']
+            partial[f'n_{depth}']    = forward.count()
+            partial[f'mean_{depth}'] = forward.mean()
+            partial[f'var_{depth}']  = forward.var(ddof = 0)
+
+        return partial.reset_index()
+
+    @classmethod
+    def combine(cls, partials: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Merges every row that shares a position and move into one, summing the counts and pooling the means and variances.
+        '''
+
+        partials = partials.copy()
+
+        for depth in cls.depths:
+            n, mean, var = partials[f'n_{depth}'], partials[f'mean_{depth}'].fillna(0), partials[f'var_{depth}'].fillna(0)
+            partials[f'sum_{depth}']   = n * mean
+            partials[f'sumsq_{depth}'] = n * (var + mean ** 2)
+
+        grouped  = partials.groupby(['board_sum', 'next_board_sum'], dropna = False, sort = False)
+        sums     = [column for column in partials.columns if column.startswith(('count', 'wins', 'draws', 'losses', 'n_', 'sum'))]
+        combined = grouped[sums].sum().join(grouped[['game_id', 'ply', 'row']].first())
+
+        for depth in cls.depths:
+            n = combined[f'n_{depth}'].replace(0, np.nan)
+            combined[f'mean_{depth}'] = combined.pop(f'sum_{depth}') / n
+            combined[f'var_{depth}']  = (combined.pop(f'sumsq_{depth}') / n - combined[f'mean_{depth}'] ** 2).clip(lower = 0)
+
+        return combined.reset_index()
+
+    def write(self,
+              aggregate : pd.DataFrame,
+              name      : str):
+        '''
+        Sorts an aggregate by board_sum and writes it as an uncompressed Arrow IPC file, so it can be memory-mapped and
+        binary searched in place. The file replaces any previous one in a single rename.
+        '''
+
+        table = pa.Table.from_pandas(aggregate.sort_values('board_sum', kind = 'stable'), preserve_index = False).combine_chunks()
+        path  = os.path.join(self.path, f'{name}.arrow')
+
+        os.makedirs(self.path, exist_ok = True)
+        with pa.OSFile(f'{path}.tmp', 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+        os.replace(f'{path}.tmp', path)
+
+    def load(self) -> Tuple[List[pa.Table], List[np.ndarray]]:
+        '''
+        Memory-maps the base segment and every delta segment, oldest first, along with their board_sum keys.
+        '''
+
+        names    = ['base'] + sorted(name[:-len('.arrow')] for name in os.listdir(self.path)
+                                     if name.startswith('delta-') and name.endswith('.arrow'))
+        segments = [pa.ipc.open_file(pa.memory_map(os.path.join(self.path, f'{name}.arrow'), 'r')).read_all() for name in names]
+
+        return segments, [segment['board_sum'].to_numpy() for segment in segments]
+
+    def build(self):
+        '''
+        Builds the base segment from the whole dataset and removes any delta segments it now covers.
+
+        The dataset is read one fragment at a time. Each fragment holds whole games, since the base is partitioned by
+        total_ply and every delta is a batch of whole games, so it can be aggregated on its own, and the partial
+        aggregates are then pooled with combine. Fragments come in dataset_files order, the same order as 
+        Utility.read_arrow, so counting the rows of earlier fragments gives each row its position in the dataset.
+        '''
+
+        dataset  = ds.dataset(self.storage.dataset_files(), format = "parquet")
+        columns  = ['game_id', 'ply', 'board_sum', 'centipawn_evaluation', 'pgn']
+        partials = []
+        offset   = 0
+
+        for fragment in dataset.get_fragments():
+            frame   = fragment.to_table(columns = columns).to_pandas()
+            partials.append(self.partial(frame, offset))
+            offset += len(frame)
+
+        os.makedirs(self.path, exist_ok = True)
+        for name in os.listdir(self.path):
+            if name.startswith('delta-'):
+                os.remove(os.path.join(self.path, name))
+
+        self.write(self.combine(pd.concat(partials, ignore_index = True)), 'base')
+        self.restamp()
+
+    def append(self,
+               frame  : pd.DataFrame,
+               name   : str,
+               offset : int):
+        '''
+        Aggregates the games of a newly ingested delta into a segment of its own. offset is the number of dataset rows
+        before the delta, which is where its rows start. The cost depends only on the size of the delta. Lookups pool the
+        new segment with the others until the next compaction.
+        '''
+
+        self.write(self.partial(frame, offset), name)
+        self.restamp()
+        self.segments, self.keys = self.load()
+
+    def compact(self):
+        '''
+        Pools every delta segment into the base segment and removes the deltas. Compaction moves the delta rows into the
+        base files, which changes the row order of the dataset, so the example rows are located again.
+        '''
+
+        segments        = [segment.to_pandas(types_mapper = {pa.uint64(): pd.UInt64Dtype()}.get) for segment in self.segments]
+        combined        = self.combine(pd.concat(segments, ignore_index = True))
+        combined['row'] = self.locate(combined['game_id'].to_numpy(), combined['ply'].to_numpy())
+        self.write(combined, 'base')
+
+        for name in os.listdir(self.path):
+            if name.startswith('delta-'):
+                os.remove(os.path.join(self.path, name))
+
+        self.restamp()
+        self.segments, self.keys = self.load()
+
+    def locate(self,
+               game_ids : np.ndarray,
+               plies    : np.ndarray) -> np.ndarray:
+        '''
+        Returns the row of each (game_id, ply) pair in the concatenated dataset. Only the game_id and ply columns are
+        read, which is the same kind of single column scan the position index does when its base segment is rebuilt.
+        '''
+
+        table  = ds.dataset(self.storage.dataset_files(), format = "parquet").to_table(columns = ['game_id', 'ply'])
+        keys   = table['game_id'].to_numpy().astype(np.int64) << 16 | table['ply'].to_numpy().astype(np.int64)
+        order  = np.argsort(keys, kind = 'stable')
+        wanted = np.asarray(game_ids, dtype = np.int64) << 16 | np.asarray(plies, dtype = np.int64)
+
+        return order[np.searchsorted(keys, wanted, sorter = order)]
+
+    def lookup(self, board_sum: int) -> pd.DataFrame:
+        '''
+        Returns one row per move played from the position, found with a binary search in each segment. Rows for the
+        same move from different segments are pooled.
+        '''
+
+        key     = np.uint64(board_sum)
+        matches = []
+
+        for segment, keys in zip(self.segments, self.keys):
+            start = np.searchsorted(keys, key, side = 'left')
+            end   = np.searchsorted(keys, key, side = 'right')
+            if end > start:
+                matches.append(segment.slice(start, end - start).to_pandas(types_mapper = {pa.uint64(): pd.UInt64Dtype()}.get))
+
+        if not matches:
+            return pd.DataFrame()
+
+        return matches[0] if len(matches) == 1 else self.combine(pd.concat(matches, ignore_index = True))
@@ -1,4 +1,5 @@
-from Dagger   import *
+from Cache     import *
+from Dagger    import *
 from Navigator import *
 from Parser    import *
 from Utilities import *
@@ -7,8 +8,13 @@ def main():
 
     files  = Utility()
     parser = Parser(files())
-    dag    = Dagger(files, parser)()
-    # Navigator(parser, dag[0], dag[1])
+    cache  = Cache(files, persist = True)
+
+    # The search runs on Navigator's background executor, so the window opens before the dataset has loaded
+    try:
+        Navigator(parser, search = lambda: Dagger(files, parser, cache = cache))()
+    finally:
+        cache.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,184 @@
+from   Utilities   import *
+from   collections import OrderedDict
+from   typing      import *
+import os
+import shelve
+
+class Cache:
+    '''
+    The Cache class memoizes the result of a single Dagger search step, so that repeated searches from the same
+    learning moment do not have to filter and score the dataset again. Entries live in an in-process LRU and,
+    optionally, in an on-disk shelf that survives between runs.
+
+    Attributes:
+        storage   (Utility)     : The Utility whose Parquet dataset the cached entries were computed against.
+        version   (str)         : The dataset version the cached entries were computed against.
+        capacity  (int)         : The maximum number of entries kept in the in-process LRU.
+        path      (str)         : The path to the on-disk shelf, or None to keep the cache in memory only.
+        memory    (OrderedDict) : The in-process LRU, ordered from least to most recently used.
+        counts    (dict)        : Hit and miss counters for each tier.
+
+    Methods:
+        open_disk : Opens the on-disk shelf, wiping it if it belongs to another dataset version.
+        refresh   : Re-reads the dataset version and empties both tiers if it has changed.
+        key       : Builds the cache key for a search step.
+        get       : Returns a cached entry, checking the LRU first and the disk tier second.
+        remember  : Inserts an entry into the LRU and evicts the least recently used entries beyond capacity.
+        put       : Stores an entry in both tiers.
+        clear     : Empties both tiers.
+        stats     : Returns the hit and miss counts, along with the hit rate, for each tier.
+        close     : Closes the on-disk shelf.
+
+    Invalidation:
+        The dataset version is part of every key, so an entry computed against an older dataset can never be returned.
+        The disk tier additionally records the version it was written under and is wiped when opened with a different
+        one, which keeps stale entries from accumulating on disk. Dagger calls refresh before every search, so a
+        long-running process picks up a changed dataset as well.
+    '''
+
+    version_key = "__version__"
+
+    def __init__(self,
+                 storage  : Utility,
+                 capacity : int  = 1024,
+                 persist  : bool = False):
+
+        self.storage  = storage
+        self.version  = storage.dataset_version()
+        self.capacity = capacity
+        self.path     = os.path.join(os.path.dirname(storage.pq_path), 'Cache', storage.pq_name) if persist else None
+        self.memory   = OrderedDict()
+        self.counts   = {"memory": {"hits": 0, "misses": 0},
+                         "disk"  : {"hits": 0, "misses": 0}}
+        self.disk     = self.open_disk() if persist else None
+
+    def open_disk(self) -> shelve.Shelf:
+        '''
+        Opens the on-disk shelf and clears it if it was written against a different dataset version.
+        '''
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok = True)
+        disk = shelve.open(self.path)
+
+        if disk.get(self.version_key) != self.version:
+            disk.clear()
+            disk[self.version_key] = self.version
+
+        return disk
+
+    def refresh(self):
+        '''
+        Re-reads the dataset version from storage. If the dataset has changed since the cache was built, every entry in
+        both tiers is dropped, since none of them can be hit under the new version anyway.
+        '''
+
+        version = self.storage.dataset_version()
+
+        if version != self.version:
+            self.version = version
+            self.clear()
+
+    def key(self,
+            board_sum       : int,
+            user_centipawn  : float,
+            user_preference : str,
+            lambda_reg      : float,
+            depth           : int,
+            scoring         : str = "rows") -> str:
+        '''
+        Builds the cache key for a search step from the position hash, the loss parameters, the scoring mode and the
+        dataset version. The loss compares every candidate with the centipawn value of the user's learning moment, which
+        later steps keep while searching from other positions, so that value is part of the key as well.
+        '''
+
+        return f"{int(board_sum)}|{user_centipawn!r}|{user_preference}|{float(lambda_reg)!r}|{int(depth)}|{scoring}|{self.version}"
+
+    def get(self, key: str) -> Optional[Dict]:
+        '''
+        Returns the cached entry for the given key, or None if neither tier holds it.
+
+        A hit in the LRU marks the entry as most recently used. A hit in the disk tier promotes the entry into the LRU.
+        '''
+
+        if key in self.memory:
+            self.counts["memory"]["hits"] += 1
+            self.memory.move_to_end(key)
+            return self.memory[key]
+
+        self.counts["memory"]["misses"] += 1
+
+        if self.disk is None:
+            return None
+
+        if key in self.disk:
+            self.counts["disk"]["hits"] += 1
+            entry = self.disk[key]
+            self.remember(key, entry)
+            return entry
+
+        self.counts["disk"]["misses"] += 1
+        return None
+
+    def remember(self, key: str, entry: Dict):
+        '''
+        Inserts an entry into the LRU, evicting the least recently used entry once the capacity is exceeded.
+        '''
+
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last = False)
+
+    def put(self, key: str, entry: Dict):
+        '''
+        Stores an entry in the LRU and, if enabled, in the disk tier. The shelf is synced after every write, since some
+        dbm backends only write their index on sync or close, and an entry would otherwise be lost if the process ended
+        without closing the cache.
+        '''
+
+        self.remember(key, entry)
+
+        if self.disk is not None:
+            self.disk[key] = entry
+            self.disk.sync()
+
+    def clear(self):
+        '''
+        Empties both tiers and resets the hit and miss counters.
+        '''
+
+        self.memory.clear()
+        for tier in self.counts.values():
+            tier.update(hits = 0, misses = 0)
+
+        if self.disk is not None:
+            self.disk.clear()
+            self.disk[self.version_key] = self.version
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        '''
+        Returns the hit and miss counts and the hit rate of each tier, plus the overall hit rate across both tiers.
+        The LRU size is included so the capacity can be sized against the observed working set.
+        '''
+
+        stats = {}
+        for tier, counts in self.counts.items():
+            lookups     = counts["hits"] + counts["misses"]
+            stats[tier] = {**counts, "hit_rate": counts["hits"] / lookups if lookups else 0.0}
+
+        lookups          = self.counts["memory"]["hits"] + self.counts["memory"]["misses"]
+        hits             = self.counts["memory"]["hits"] + self.counts["disk"]["hits"]
+        stats["overall"] = {"hits": hits, "misses": lookups - hits, "hit_rate": hits / lookups if lookups else 0.0}
+        stats["size"]    = {"entries": len(self.memory), "capacity": self.capacity}
+
+        return stats
+
+    def close(self):
+        '''
+        Closes the on-disk shelf, which writes out anything it still buffers. The cache keeps working from the LRU alone.
+        '''
+
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
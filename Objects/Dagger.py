@@ -1,10 +1,16 @@
-from   Parser    import *
-from   Utilities import *
-from   typing    import *
+from   Aggregates import *
+from   Cache      import *
+from   Index      import *
+from   Parser     import *
+from   Shards     import *
+from   Utilities  import *
+from   typing     import *
 import heapq
+import warnings
 import numpy           as np
 import pandas          as pd
-import pyarrow.dataset as ds
+import pyarrow         as pa
+import pyarrow.compute as pc
         
 class Dagger:
     '''
@@ -14,17 +20,32 @@ class Dagger:
     of centipawn_value for the next 5 moves.
 
     Attributes:
-        games_df              (pd.DataFrame) : A DataFrame containing chess games information.
+        games                 (pa.Table)     : A memory-mapped Arrow table containing chess games information.
         user_board_sum        (int)          : User's input board sum to match.
         user_centipawn_value  (int)          : User's input centipawn value to compare.
         user_preference       (str)          : User's preference ("white" or "black") to guide the search.
+        lambda_reg            (float)        : The regularization strength of the loss function.
+        depth                 (int)          : The number of following plies averaged by the loss function.
+        index                 (Index)        : The position index over self.games, used for candidate lookups.
+        cache                 (Cache)        : An optional cache of search steps, shared across searches.
+        shards                (Shards)       : Optional shard workers to query instead of loading the whole dataset.
+        aggregates            (Aggregates)   : An optional per-position aggregate table to score moves instead of rows.
         result                ((List[dict])) : List of results containing the best line of 5 moves.
 
     Methods:
-        __init__        : Initializes the object with the given user input and games DataFrame.
-        loss_function   : Defines a loss function using L2 regularization.
-        dijkstra_search : Implements Dijkstra's algorithm to search through the games.
-        __call__        : Executes the search and optionally prints the result.
+        __init__                  : Initializes the object with the given user input and games DataFrame.
+        find_best_learning_moment : Finds the position in the user's game with the largest swing in centipawn value.
+        loss_function             : Defines a loss function using L2 regularization.
+        aggregate_loss            : Returns the expected value of the loss function over every occurrence of a move.
+        candidates                : Returns every position matching a board sum, locally or from its owning shard.
+        forward_values            : Returns the centipawn values of the plies that follow each candidate.
+        next_board_sum            : Returns the board sum of the position that followed a candidate in its game.
+        search_step               : Scores every position matching a board sum and returns the best one.
+        aggregate_step            : Scores every move played from a board sum using the aggregate table.
+        cached_search_step        : Wraps search_step with the cache, if one was provided.
+        search_steps              : Implements Dijkstra's algorithm, yielding the best move of each step as it is found.
+        dijkstra_search           : Runs the search to completion and builds a Parser for each result.
+        __call__                  : Executes the search and optionally prints the result.
 
     Mathematics Background:
         The loss function used in this class is a combination of mean squared error (MSE) and L2 regularization (ridge regression).
@@ -55,10 +76,18 @@ class Dagger:
 
         The result, best_line, represents the best sequence of moves that minimize the cost, considering centipawn evaluations and user preference.
 
+        Aggregate Scoring:
+        With an aggregate table, step 2a enqueues moves instead of positions. A move played n times from the position has forward values
+        with mean μ and variance σ², so its expected loss over those n occurrences is
+            E[L] = ((μ - user_centipawn_value)² + σ²) / depth + λ * (μ² + σ²)
+        The search then prefers moves that were good on average rather than the single occurrence that happened to score best, and the
+        step no longer reads any raw rows except for the one example game of the winning move.
+
     Time Complexity:
         Loss Function Calculation: 
         The time complexity of the loss function is 𝒪(depth), where depth is the number of moves considered in the evaluation (e.g., 10). The 
-        calculation involves iterating through the next depth moves to compute the average predicted centipawn value.
+        calculation involves iterating through the next depth moves to compute the average predicted centipawn value. All m candidates of a 
+        step are scored together as one (m, depth) array operation, so the per-candidate cost stays out of the Python interpreter.
 
         Dijkstra's Algorithm (Adapted): 
         The time complexity of the adapted Dijkstra's algorithm is 𝒪(5 * m * log(m)), where m is the number of positions with the same board 
@@ -66,18 +95,36 @@ class Dagger:
         resulting in a log(m) time complexity for enqueue and dequeue operations.
 
         Therefore, the total time complexity of the algorithm is 𝒪(mlog(m)), as dictated by the dominated term in the Dijkstra's adaptation.
+
+        With an aggregate table, a step costs 𝒪(log(P)) for the binary search over P distinct positions, plus 𝒪(k) for its k distinct
+        moves, which is usually far smaller than m.
     '''
 
     def __init__(self, 
                  storage         : Utility, 
                  user_parser     : Parser,
-                 user_preference : str   = "white",
-                 lambda_reg      : float = 0.01):
+                 user_preference : str                  = "white",
+                 lambda_reg      : float                = 0.01,
+                 depth           : int                  = 10,
+                 cache           : Optional[Cache]      = None,
+                 shards          : Optional[Shards]     = None,
+                 aggregates      : Optional[Aggregates] = None):
+
+        if shards is not None and depth > shards.max_depth:
+            raise ValueError(f"A depth of {depth} exceeds the {shards.max_depth} following plies stored in each shard.")
+
+        if aggregates is not None and depth not in aggregates.depths:
+            raise ValueError(f"A depth of {depth} is not one of the depths {aggregates.depths} stored in the aggregate table.")
 
-        self.games                = self.read_entire_directory(storage.pq_path)
+        self.games                = storage.read_arrow() if shards is None else None
+        self.index                = Index(storage) if shards is None else None
         self.user_parser          = user_parser
         self.user_preference      = user_preference
         self.lambda_reg           = lambda_reg
+        self.depth                = depth
+        self.cache                = cache
+        self.shards               = shards
+        self.aggregates           = aggregates
         self.results              = {i + 1: {} for i in range(5)}
 
         self.user_board_sum, self.user_centipawn, self.best_index = self.find_best_learning_moment()
@@ -99,123 +146,245 @@ class Dagger:
                self.user_parser.positions[best_index].centipawn,               \
                best_index
 
-    def read_entire_directory(self, storage_directory: str):
+    def loss_function(self, 
+                      pred_values : np.ndarray,
+                      depth       : int = 10) -> np.ndarray:
+        '''
+        Defines a loss function based on ridge regression (L2 regularization).
+        The function captures the difference between the predicted value and the actual value,
+        penalizing large coefficients to prevent overfitting.
+
+        The loss is computed for every candidate at once. pred_values holds one row per candidate with the centipawn 
+        values of its next depth plies, padded with NaN where a game ends early. Candidates with no values at all are
+        given an infinite cost, so they are only chosen if nothing else matched.
         '''
-        Read the entire directory of Parquet files within the specified storage directory.
 
-        Arguments:
-            storage_directory : Directory containing the partitions.
-            columns           : List of columns to read (optional).
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            pred = np.nanmean(pred_values, axis = 1) * (1 if self.user_preference != "black" else -1)
+
+        mse_term = ((pred - self.user_centipawn) ** 2)
+        reg_term = self.lambda_reg * (pred ** 2)
+        loss     = mse_term / depth + reg_term
+
+        return np.where(np.isnan(loss), np.inf, loss)
+
+    def aggregate_loss(self,
+                       mean     : np.ndarray,
+                       variance : np.ndarray,
+                       depth    : int = 10) -> np.ndarray:
+        '''
+        Returns, for each move, the expected value of loss_function over every occurrence of the move, given the mean and
+        variance of their forward centipawn values. Flipping the sign for black leaves the variance unchanged. Moves with
+        no forward values at all are given an infinite cost, as in loss_function.
+        '''
+
+        pred     = mean * (1 if self.user_preference != "black" else -1)
+        mse_term = (pred - self.user_centipawn) ** 2 + variance
+        reg_term = self.lambda_reg * (pred ** 2 + variance)
+        loss     = mse_term / depth + reg_term
+
+        return np.where(np.isnan(loss), np.inf, loss)
+
+    def candidates(self, board_sum: int) -> pa.Table:
+        '''
+        Returns every position matching board_sum as an Arrow table. With shards, the lookup is sent to the worker that 
+        owns board_sum. Otherwise the position index gives the matching row numbers and only those rows are taken from 
+        the memory-mapped table, with their row numbers appended so the following plies can be read for the loss.
+        '''
+
+        if self.shards is not None:
+            return self.shards.lookup([board_sum])
+
+        rows = self.index.rows(board_sum)
+        return self.games.take(rows).append_column('row', pa.array(rows, type = pa.int64()))
+
+    def forward_values(self, candidates: pa.Table) -> np.ndarray:
+        '''
+        Returns a (candidates, depth) array of the centipawn values for each candidate and the plies that follow it in
+        the same game, padded with NaN past the end of the game.
+
+        Shard rows carry these values in their forward_centipawn lists. Locally, the values are gathered with a single 
+        take over a grid of the rows that follow each candidate, along with their game_id and ply. A value is kept only
+        while every row up to it is the next ply of the candidate's game, so rows of another game, or plies that are
+        missing or out of order, end the candidate's values rather than being read as its continuation.
+        '''
+
+        m      = candidates.num_rows
+        values = np.full((m, self.depth), np.nan)
+
+        if self.shards is not None:
+            forward = pc.list_slice(candidates['forward_centipawn'].combine_chunks(), 0, self.depth)
+            lengths = pc.list_value_length(forward).to_numpy(zero_copy_only = False)
+            values[np.arange(self.depth) < lengths[:, None]] = \
+                pc.cast(pc.list_flatten(forward), pa.float64()).to_numpy(zero_copy_only = False)
+            return values
+
+        starts = candidates['row'].to_numpy()
+        grid   = np.minimum(starts[:, None] + np.arange(self.depth), self.games.num_rows - 1)
+        games  = pc.take(self.games['game_id'], grid.ravel()).to_numpy(zero_copy_only = False).reshape(grid.shape)
+        plies  = pc.take(self.games['ply'],     grid.ravel()).to_numpy(zero_copy_only = False).reshape(grid.shape)
+        cents  = pc.cast(pc.take(self.games['centipawn_evaluation'], grid.ravel()), pa.float64()) \
+                   .to_numpy(zero_copy_only = False).reshape(grid.shape)
+        same   = np.logical_and.accumulate((games == games[:, :1])                                 &
+                                           (plies == plies[:, :1] + np.arange(self.depth))         &
+                                           (grid  == starts[:, None] + np.arange(self.depth)), axis = 1)
+
+        values[same] = cents[same]
+        return values
+
+    def next_board_sum(self, best_move: Dict) -> Optional[int]:
+        '''
+        Returns the board_sum of the position that followed best_move in its game, or None if best_move ended the game.
+
+        Locally, every game is contiguous in self.games, so the next ply is the next row, and a next row from a different
+        game (or no next row at all) means best_move ended its game. Only if the plies of a game are out of order is the 
+        table filtered on game_id and ply with pyarrow.compute.
+        '''
+
+        if self.shards is not None:
+            return best_move['next_board_sum']
+
+        following = self.games.select(['game_id', 'ply', 'board_sum']).slice(best_move['row'] + 1, 1).to_pylist()
+        if not following or following[0]['game_id'] != best_move['game_id']:
+            return None
+
+        if following[0]['ply'] == best_move['ply'] + 1:
+            return following[0]['board_sum']
+
+        next_ply_row = self.games.filter(pc.and_(pc.equal(self.games['ply'],     best_move['ply'] + 1),
+                                                 pc.equal(self.games['game_id'], best_move['game_id'])))
+
+        return next_ply_row['board_sum'][0].as_py() if next_ply_row.num_rows else None
+
+    def search_step(self, board_sum: int) -> Optional[Dict]:
+        '''
+        Performs a single step of the search. Every position matching board_sum is enqueued with its cost from the loss 
+        function, and the position with the lowest cost is dequeued. 
 
         Returns:
-            DataFrame : Pandas DataFrame containing the data from all partitions.
+            best_move : The pgn, ply, game_id and centipawn value of the best position, along with the board_sum of the 
+                        position that followed it in its game (None at the end of a game). None if nothing matched.
         '''
 
-        dataset = ds.dataset(storage_directory, format = "parquet")
-        table = dataset.to_table()
+        if self.aggregates is not None:
+            return self.aggregate_step(board_sum)
 
-        return table.to_pandas()
+        filtered_games = self.candidates(board_sum)
 
-    def loss_function(self, 
-                      row   : pd.Series,
-                      depth : int = 10) -> float:
+        if filtered_games.num_rows == 0:
+            return None
+
+        costs = self.loss_function(self.forward_values(filtered_games), self.depth)
+        queue = list(zip(costs.tolist(), range(len(costs))))
+        heapq.heapify(queue)
+
+        # Only the winning row is ever converted into Python objects
+        best_move = filtered_games.slice(heapq.heappop(queue)[1], 1).to_pylist()[0]
+
+        return {"pgn"            : best_move['pgn'],
+                "ply"            : best_move['ply'],
+                "game_id"        : best_move['game_id'],
+                "centipawn"      : best_move['centipawn_evaluation'],
+                "next_board_sum" : self.next_board_sum(best_move)}
+
+    def aggregate_step(self, board_sum: int) -> Optional[Dict]:
         '''
-        Defines a loss function based on ridge regression (L2 regularization).
-        The function captures the difference between the predicted value and the actual value,
-        penalizing large coefficients to prevent overfitting.
+        Performs a single step of the search from the aggregate table. Every move played from board_sum is enqueued with 
+        its expected loss, and the move with the lowest cost is dequeued. The example occurrence stored with that move is
+        the only row read from the dataset, to give the result a game to show. Locally it is a single slice at the row the
+        aggregate table recorded. Shards have no global row numbers, so there the example is picked out of the matching rows.
+
+        Returns:
+            best_move : The same fields as search_step, for the example occurrence of the best move, along with how many
+                        times the move was played and how those games ended. None if nothing matched.
         '''
 
-        start_idx   = row.name
-        pred_values = self.games.loc[start_idx : start_idx + depth - 1, 'centipawn_evaluation']
-        pred        = np.mean(pred_values) * (1 if self.user_preference != "black" else -1)
+        moves = self.aggregates.lookup(board_sum)
+
+        if moves.empty:
+            return None
+
+        costs = self.aggregate_loss(moves[f'mean_{self.depth}'].to_numpy(dtype = float, na_value = np.nan),
+                                    moves[f'var_{self.depth}'].to_numpy(dtype = float, na_value = np.nan),
+                                    self.depth)
+        queue = list(zip(costs.tolist(), range(len(costs))))
+        heapq.heapify(queue)
+
+        # Read the winner column by column, since a mixed row would turn the uint64 board sums into floats
+        best = heapq.heappop(queue)[1]
+        move = {column: moves[column].iloc[best] for column in moves.columns}
+
+        if self.shards is None:
+            example = self.games.slice(int(move['row']), 1).to_pylist()[0]
+        else:
+            examples = self.candidates(board_sum)
+            example  = examples.filter(pc.and_(pc.equal(examples['game_id'], int(move['game_id'])),
+                                               pc.equal(examples['ply'],     int(move['ply'])))).slice(0, 1).to_pylist()[0]
+
+        return {"pgn"            : example['pgn'],
+                "ply"            : example['ply'],
+                "game_id"        : example['game_id'],
+                "centipawn"      : example['centipawn_evaluation'],
+                "next_board_sum" : None if pd.isna(move['next_board_sum']) else int(move['next_board_sum']),
+                "count"          : int(move['count']),
+                "wins"           : int(move['wins']),
+                "draws"          : int(move['draws']),
+                "losses"         : int(move['losses'])}
+
+    def cached_search_step(self, board_sum: int) -> Optional[Dict]:
+        '''
+        Returns the result of search_step for board_sum, reading it from the cache when possible and storing it on a miss.
+        Steps that found nothing are not cached, so they are retried once the dataset grows.
+        '''
 
-        mse_term = ((pred - self.user_centipawn) ** 2)
-        reg_term = self.lambda_reg * (pred ** 2)
-        return mse_term / depth + reg_term
+        if self.cache is None:
+            return self.search_step(board_sum)
 
-    # def dijkstra_search(self):
-    #     '''
-    #     Implements Dijkstra's algorithm to find the best match by traversing the graph of chess positions.
-    #     The search is guided by a loss function, and the result is stored in the result attribute.
-    #     '''
+        scoring   = "aggregates" if self.aggregates is not None else "rows"
+        key       = self.cache.key(board_sum, self.user_centipawn, self.user_preference, self.lambda_reg, self.depth, scoring)
+        best_move = self.cache.get(key)
 
-    #     current_board_sum = self.user_board_sum
-    #     for i in range(5):
-    #         # Filter games based on current_board_sum
-    #         filtered_gamess = self.games[self.games['board_sum'] == current_board_sum]
+        if best_move is None:
+            best_move = self.search_step(board_sum)
+            if best_move is not None:
+                self.cache.put(key, best_move)
 
-    #         # Calculate cost for each row using apply method
-    #         costs = filtered_gamess.apply(self.loss_function, axis = 1).values
+        return best_move
 
-    #         # Create a heap (priority queue) based on the calculated cost
-    #         queue = [(cost, i) for i, cost in enumerate(costs)]
-    #         heapq.heapify(queue)
-    #         best_move = filtered_gamess.iloc[heapq.heappop(queue)[1]]
+    def search_steps(self) -> Iterator[Dict]:
+        '''
+        Implements Dijkstra's algorithm to find the best line by traversing the graph of chess positions, yielding the 
+        best move of each step as soon as it is found. This lets callers such as Navigator show results as they arrive.
 
-    #         # Create a Parser object using the pgn field of the best_move
-    #         parser_obj = Parser(best_move['pgn'])
-    #         ply_index = best_move['ply']
+        The search stops early if a step finds no matching positions or reaches the end of a game.
+        '''
+
+        if self.cache is not None:
+            self.cache.refresh()
+
+        current_board_sum = self.user_board_sum
+        for run in range(5):
+            best_move = self.cached_search_step(current_board_sum)
+
+            if best_move is None:
+                return
 
-    #         # Store the Parser object and ply index for the move directly in self.results
-    #         self.results[i + 1] = {'parser': parser_obj, 'ply': ply_index}
-            
-    #         # Update current_board_sum for the next iteration
-    #         current_board_sum = self.games.iloc[best_move['ply'] + 1]['board_sum']
+            yield best_move
 
+            if best_move['next_board_sum'] is None:
+                return
 
-    import sys
+            current_board_sum = best_move['next_board_sum']
 
     def dijkstra_search(self):
-        with open("log.txt", "w") as log_file:
-            sys.stdout = log_file
-            print(f"Current board sum: {self.user_board_sum}\n")
-
-            final_moves = {}  # Dictionary to store final 5 moves
-
-            for run in range(5):
-                print(f"Run {run + 1} of 5:")
-                filtered_games = self.games[self.games['board_sum'] == self.user_board_sum].reset_index(drop=True)
-
-                queue = []
-                for i, row in filtered_games.iterrows():
-                    cost = self.loss_function(row)
-                    queue.append((cost, i))
-                    print(f"Enqueuing row with index {i}: {row.to_dict()}") 
-
-                best_index = heapq.heappop(queue)[1]
-                print(f"  Top 5 elements in the queue before popping: {queue[:5]}")
-                
-                best_move = filtered_games.iloc[best_index]
-                print(f"  Dequeued row with index {best_index}: {best_move.to_dict()}")
-                print(f"  Best move details: ply={best_move['ply']}, board_sum={best_move['board_sum']}")
-
-                parser_obj = Parser(best_move['pgn'], False)
-                ply_index = best_move['ply']
-                self.results[run + 1] = {'parser': parser_obj, 'ply': ply_index}
-
-                next_ply = best_move['ply'] + 1
-                next_game_id = best_move['game_id']
-                next_board_sum_row = self.games[(self.games['ply'] == next_ply) & (self.games['game_id'] == next_game_id)]
-                self.user_board_sum = next_board_sum_row['board_sum'].iloc[0]
-                print(f"  Next ply details: index={next_ply}, board_sum={self.user_board_sum}")
-                print(f"  Top 5 elements in the queue after popping: {queue[:5]}\n")
-
-                # Store the details in the final_moves dictionary
-                final_moves[run + 1] = {
-                    "ply": next_ply,
-                    "board_sum": self.user_board_sum,
-                    "centipawn_value": best_move['centipawn_evaluation'],
-                    "pgn": best_move['pgn']
-                }
-
-            print("\nFinal 5 moves selected:")
-            for i in range(1, 6):
-                move_details = final_moves[i]
-                print(f"  Move {i}:")
-                print(f"    Ply: {move_details['ply']}")
-                print(f"    Board Sum: {move_details['board_sum']}")
-                print(f"    Centipawn Value: {move_details['centipawn_value']}")
-                print(f"    PGN: {move_details['pgn']}\n")
+        '''
+        Runs the search to completion and stores the result in the results attribute.
+        '''
+
+        for run, best_move in enumerate(self.search_steps()):
+            # Store the Parser object and ply index for the move directly in self.results
+            self.results[run + 1] = {'parser': Parser(best_move['pgn'], False), 'ply': best_move['ply']}
 
     def __call__(self):
         self.dijkstra_search()
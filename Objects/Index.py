@@ -0,0 +1,124 @@
+from   Utilities import *
+from   typing    import *
+import numpy             as np
+import os
+import pyarrow.dataset   as ds
+
+class Index:
+    '''
+    The Index class maps each board_sum to the rows of the dataset that hold it, so that a lookup is a binary search
+    instead of a scan over every row. The dataset is made of a base and a series of delta files, and the index mirrors
+    that layout with one segment per part: adding a delta only has to index the rows of that delta.
+
+    Attributes:
+        storage  (Utility)    : The Utility whose dataset is indexed.
+        segments (List[dict]) : One segment per part of the dataset, in the order of storage.dataset_files().
+
+    Methods:
+        build        : Sorts the board sums of a list of files into a segment.
+        segment_path : Returns the path of the index file for a segment.
+        load_segment : Loads a segment from disk, rebuilding it if its files have changed since it was written.
+        load         : Loads the base segment and one segment per delta file.
+        add_delta    : Indexes a newly written delta file.
+        rebuild_base : Rebuilds the base segment, after a compaction has folded the deltas into the base.
+        rows         : Returns the positions of every row matching a board_sum.
+
+    Segments:
+        Each segment is stored as an .npz file with the keys sorted, the row each key came from, the number of rows in
+        the segment and the fingerprint of the files it was built from. Row positions are local to the segment and are
+        offset by the rows of every earlier segment at lookup time, which keeps them valid as more deltas are appended.
+    '''
+
+    def __init__(self, storage: Utility):
+
+        self.storage  = storage
+        self.segments = self.load()
+
+    @staticmethod
+    def build(files: List[str]) -> Dict[str, Union[np.ndarray, int, str]]:
+        '''
+        Reads only the board_sum column of the given files and sorts it, keeping the position each key came from.
+        A stable sort keeps the rows of each key in dataset order.
+        '''
+
+        board_sums = ds.dataset(files, format = "parquet").to_table(columns = ['board_sum'])['board_sum'].to_numpy() \
+                     if files else np.array([], dtype = np.uint64)
+        board_sums = board_sums.astype(np.uint64)
+        order      = np.argsort(board_sums, kind = 'stable')
+
+        return {"keys"        : board_sums[order],
+                "rows"        : order.astype(np.int64),
+                "n_rows"      : len(board_sums),
+                "fingerprint" : Utility.fingerprint(files)}
+
+    def segment_path(self, name: str) -> str:
+        return os.path.join(self.storage.index_path, f'{name}.npz')
+
+    def load_segment(self,
+                     name  : str,
+                     files : List[str]) -> Dict[str, Union[np.ndarray, int, str]]:
+        '''
+        Loads the segment called name, rebuilding and saving it if it is missing or was built from different files.
+        '''
+
+        path = self.segment_path(name)
+
+        if os.path.exists(path):
+            with np.load(path) as saved:
+                segment = {"keys"        : saved["keys"],
+                           "rows"        : saved["rows"],
+                           "n_rows"      : int(saved["n_rows"]),
+                           "fingerprint" : str(saved["fingerprint"])}
+
+            if segment["fingerprint"] == Utility.fingerprint(files):
+                return segment
+
+        segment = self.build(files)
+        os.makedirs(self.storage.index_path, exist_ok = True)
+        np.savez(path, **segment)
+
+        return segment
+
+    def load(self) -> List[Dict]:
+        '''
+        Loads the base segment followed by one segment per delta file, in the same order as storage.dataset_files().
+        Index files left behind by deltas that have since been compacted are removed.
+        '''
+
+        self.storage.remove_stale(self.storage.index_path, '.npz')
+
+        return [self.load_segment(name, files) for name, files in self.storage.parts()]
+
+    def add_delta(self, delta_file: str):
+        '''
+        Indexes a newly written delta file and appends it as the last segment. The cost depends only on the size of
+        the delta, not on the size of the dataset.
+        '''
+
+        name = os.path.basename(delta_file)[:-len('.parquet')]
+        self.segments.append(self.load_segment(name, [delta_file]))
+
+    def rebuild_base(self):
+        '''
+        Reloads every segment once the deltas have been folded into the base. This is the only step that reads the
+        whole board_sum column, and it is meant to run as part of the background compaction.
+        '''
+
+        self.segments = self.load()
+
+    def rows(self, board_sum: int) -> np.ndarray:
+        '''
+        Returns the positions, in the concatenated dataset, of every row whose board_sum matches, in dataset order.
+        '''
+
+        key    = np.uint64(board_sum)
+        rows   = []
+        offset = 0
+
+        for segment in self.segments:
+            start = np.searchsorted(segment["keys"], key, side = 'left')
+            end   = np.searchsorted(segment["keys"], key, side = 'right')
+            rows.append(segment["rows"][start:end] + offset)
+            offset += segment["n_rows"]
+
+        return np.sort(np.concatenate(rows))
@@ -0,0 +1,207 @@
+from   Aggregates import *
+from   Index      import *
+from   Parser     import *
+from   Shards     import *
+from   Utilities  import *
+from   typing     import *
+import numpy             as np
+import os
+import pandas            as pd
+import pyarrow           as pa
+import pyarrow.compute   as pc
+import pyarrow.dataset   as ds
+import pyarrow.parquet   as pq
+import threading
+
+class Ingestor:
+    '''
+    The Ingestor class appends new games to the dataset without rebuilding it. Each batch of games is parsed, evaluated
+    and written as a numbered delta Parquet file, and every derived structure is updated with just that delta. Once
+    enough deltas have piled up, a background compaction folds them into the base dataset.
+
+    Attributes:
+        storage    (Utility)          : The Utility whose dataset receives the new games.
+        index      (Index)            : The position index, extended with a new segment for every delta.
+        shards     (Shards)           : Optional shards, extended with the rows each shard owns from every delta.
+        aggregates (Aggregates)       : An optional aggregate table, extended with a segment for every delta.
+        max_deltas (int)              : The number of deltas that triggers a background compaction.
+        lock       (threading.Lock)   : Serializes ingestion and compaction within the process.
+        compactor  (threading.Thread) : The running compaction thread, if any.
+
+    Methods:
+        manifest       : Reads the counters for the next delta number and the next game_id.
+        save_manifest  : Writes those counters back to disk.
+        to_rows        : Turns a parsed game into one row per position.
+        ingest         : Parses a batch of games and writes them as a new delta.
+        compact        : Folds every delta into the base dataset, in a background thread by default.
+        wait           : Blocks until a running compaction has finished.
+
+    Cost:
+        Ingesting a batch of g games with p positions each costs 𝒪(g * p) for parsing and evaluation, plus
+        𝒪(g * p * log(g * p)) to sort the new segment of the position index. Nothing about the existing dataset is read,
+        except a single scan of the game_id column the very first time, to find where new game_ids should start.
+        Compaction rewrites no existing base files either, but it does rebuild the base segment of the position index
+        and the base IPC copy of the dataset, and pools the delta segments of the aggregate table into its base segment.
+    '''
+
+    def __init__(self,
+                 storage    : Utility,
+                 shards     : Optional[Shards]     = None,
+                 aggregates : Optional[Aggregates] = None,
+                 max_deltas : int                  = 16):
+
+        self.storage    = storage
+        self.index      = Index(storage)
+        self.shards     = shards
+        self.aggregates = aggregates
+        self.max_deltas = max_deltas
+        self.lock       = threading.Lock()
+        self.compactor  = None
+
+    def manifest(self) -> Dict[str, int]:
+        '''
+        Returns the counters for the next delta number and the next game_id. Delta numbers keep increasing across
+        compactions, so a delta file name is never reused for different games.
+        '''
+
+        manifest = self.storage.read_manifest(os.path.join(self.storage.delta_path, '_manifest.json'))
+
+        if manifest:
+            return manifest
+
+        files     = self.storage.dataset_files()
+        max_game  = pc.max(ds.dataset(files, format = "parquet").to_table(columns = ['game_id'])['game_id']).as_py() \
+                    if files else None
+
+        return {"next_delta": 1, "next_game_id": 0 if max_game is None else max_game + 1}
+
+    def save_manifest(self, manifest: Dict[str, int]):
+
+        os.makedirs(self.storage.delta_path, exist_ok = True)
+        self.storage.write_manifest(os.path.join(self.storage.delta_path, '_manifest.json'), manifest)
+
+    @staticmethod
+    def to_rows(parser  : Parser,
+                game_id : int) -> pd.DataFrame:
+        '''
+        Turns a parsed game into one row per move, with the same columns Dagger reads from the base dataset. As in the 
+        base, ply 0 is the position after the first move, so the starting position has no row.
+        '''
+
+        pgn_string = str(parser.game)
+        positions  = parser.positions[1:]
+
+        return pd.DataFrame({"game_id"              : game_id,
+                             "ply"                  : range(len(positions)),
+                             "board_sum"            : np.array([position.bitboard_integers for position in positions], dtype = np.uint64),
+                             "centipawn_evaluation" : [position.centipawn for position in positions],
+                             "pgn"                  : pgn_string})
+
+    def ingest(self,
+               pgn_inputs : Iterable[str],
+               is_file    : bool = True) -> str:
+        '''
+        Parses and evaluates a batch of games and appends them to the dataset as a new delta file.
+
+        The method performs the following steps:
+            1. Parse each game and assign it the next free game_id.
+            2. Cast the rows to the schema of the existing dataset and write them as delta-NNNNNN.parquet.
+            3. Add a segment for the delta to the position index and the aggregate table, and route its rows to the 
+               shards that own them.
+            4. Start a background compaction if the number of deltas has reached max_deltas.
+
+        Returns:
+            delta_file : The path to the delta file that was written.
+        '''
+
+        with self.lock:
+            manifest = self.manifest()
+            frames   = []
+
+            for pgn_input in pgn_inputs:
+                frames.append(self.to_rows(Parser(pgn_input, is_file), manifest["next_game_id"]))
+                manifest["next_game_id"] += 1
+
+            if not frames:
+                raise ValueError("No games were given to ingest.")
+
+            frame = pd.concat(frames, ignore_index = True)
+            table = pa.Table.from_pandas(frame, preserve_index = False)
+            files = self.storage.dataset_files()
+
+            # Columns the base carries but a parsed game cannot provide are left null
+            if files:
+                schema = ds.dataset(files, format = "parquet").schema
+                table  = pa.table([table[name] if name in table.column_names else pa.nulls(len(table)) for name in schema.names],
+                                  names = schema.names).cast(schema)
+
+            os.makedirs(self.storage.delta_path, exist_ok = True)
+            delta_file = os.path.join(self.storage.delta_path, f'delta-{manifest["next_delta"]:06d}.parquet')
+            pq.write_table(table, delta_file)
+
+            manifest["next_delta"] += 1
+            self.save_manifest(manifest)
+
+            self.index.add_delta(delta_file)
+            if self.shards is not None:
+                self.shards.append(frame, os.path.basename(delta_file)[:-len('.parquet')])
+            if self.aggregates is not None:
+                self.aggregates.append(frame, os.path.basename(delta_file)[:-len('.parquet')],
+                                       sum(segment["n_rows"] for segment in self.index.segments[:-1]))
+
+        if len(self.storage.delta_files()) >= self.max_deltas:
+            self.compact()
+
+        return delta_file
+
+    def compact(self, background: bool = True) -> Optional[threading.Thread]:
+        '''
+        Folds every delta into the base dataset. The delta rows are written into the base under the same total_ply
+        partitioning as the rest of the games, the delta files are removed, and the base segment of the position index
+        is rebuilt. Existing base files are never rewritten.
+
+        By default the work runs in a background thread, which is returned. Only one compaction runs at a time.
+        '''
+
+        if self.compactor is not None and self.compactor.is_alive():
+            return self.compactor
+
+        def fold():
+            with self.lock:
+                delta_files = self.storage.delta_files()
+
+                if not delta_files:
+                    return
+
+                frame              = ds.dataset(delta_files, format = "parquet").to_table().to_pandas()
+                # Every game has one row per ply, starting from ply 0, so the number of rows is its total_ply
+                frame['total_ply'] = frame.groupby('game_id')['ply'].transform('size')
+                last               = os.path.basename(delta_files[-1])[:-len('.parquet')]
+
+                pq.write_to_dataset(pa.Table.from_pandas(frame, preserve_index = False),
+                                    root_path         = self.storage.pq_path,
+                                    partition_cols    = ['total_ply'],
+                                    basename_template = f'compacted-{last}-{{i}}.parquet')
+
+                for delta_file in delta_files:
+                    os.remove(delta_file)
+
+                self.index.rebuild_base()
+                self.storage.read_arrow()
+                if self.shards is not None:
+                    self.shards.restamp()
+                if self.aggregates is not None:
+                    self.aggregates.compact()
+
+        self.compactor = threading.Thread(target = fold, daemon = True)
+        self.compactor.start()
+
+        if not background:
+            self.wait()
+
+        return self.compactor
+
+    def wait(self):
+
+        if self.compactor is not None:
+            self.compactor.join()
@@ -1,7 +1,9 @@
-from   Parser      import *
-from   datetime    import datetime
-from   typing      import *
-import tkinter     as tk
+from   Parser             import *
+from   concurrent.futures import Future, ThreadPoolExecutor
+from   datetime           import datetime
+from   typing             import *
+import queue
+import tkinter            as tk
 
 class Navigator:
     '''
@@ -9,17 +11,31 @@ class Navigator:
     It uses the tkinter library for its GUI and works with Parser objects to get the list of positions from PGN files.
 
     Attributes:
-        parsers         (List[Parser]) : A list of Parser objects, each containing a game to be displayed in the slideshow.
-        parser_index    (int)          : The index of the currently active Parser object.
-        match_indices   (Tuple)        : An optional tuple with the start/end indices of the matching sequence between games from different Parsers.
-        ply_index       (int)          : The current index in the list of Position objects from the active Parser.
-        square_size     (int)          : The size of each square in the chessboard canvas.
-        ts              (datetime)     : Timestamp indicating when the game was uploaded.
+        parsers          (List[Parser])       : A list of Parser objects, each containing a game to be displayed in the slideshow.
+                                                Alternatives whose Parser is still being built are held as None.
+        parser_index     (int)                : The index of the currently active Parser object.
+        match_indices    (List[Tuple])        : The start/end indices of the matching sequence for each Parser.
+        ply_index        (int)                : The current index in the list of Position objects from the active Parser.
+        square_size      (int)                : The size of each square in the chessboard canvas.
+        ts               (datetime)           : Timestamp indicating when the game was uploaded.
+        search           (Callable)           : An optional factory returning a Dagger, whose search supplies the alternatives.
+        max_alternatives (int)                : The most alternatives shown alongside the uploaded game.
+        moves            (List[dict])         : The best move behind each alternative, as yielded by Dagger.search_steps.
+        executor         (ThreadPoolExecutor) : Runs the search and builds the alternatives' Parsers off the tkinter thread.
+        futures          (Dict[int, Future])  : The Parsers still being built, by their index in parsers.
+        updates          (queue.Queue)        : Messages from the search thread, drained on the tkinter thread by poll.
+        searching        (bool)               : Whether the search is still running.
+        polling          (bool)               : Whether poll is scheduled to run again.
+        error            (str)                : The last error raised by the background work, shown in place of the progress.
 
     Methods:
         active_indices   : Returns the start and end indices of the matching sequence for the active Parser.
         end_index        : Returns the final index in the list of Position objects for the active Parser.
         create_buttons   : Creates the navigation buttons and binds the appropriate actions to them.
+        run_search       : Runs the search on the executor and posts each result to the updates queue.
+        prefetch         : Starts building the Parser of an alternative and of the one toggle_parser switches to next.
+        poll             : Applies search results and finished Parsers on the tkinter thread.
+        close            : Stops background work and closes the window.
         toggle_parser    : Switches which parser is actively on-screen.
         update_ply_index : Updates the current index based on the button pressed and displays the new position.
         update_states    : Updates the state of navigation buttons based on the current position index.
@@ -28,28 +44,47 @@ class Navigator:
         pack_components  : Packs the labels, canvas, and buttons into the tkinter window.
         display_position : Updates the display to show the current position and metadata.
         __call__         : Displays the initial position and starts the tkinter main loop.
+
+    Threading:
+        tkinter widgets may only be touched from the thread running the main loop, so the background work never calls
+        into tkinter. The search thread posts its results to the updates queue, and poll, which reschedules itself with 
+        root.after, drains that queue and checks on the Parser futures. Building a Parser evaluates every position with
+        Stockfish, so only the alternative after the one on screen is built ahead of time, which keeps toggle_parser
+        instant without evaluating games the user never looks at.
     '''
 
     def __init__(self, 
-                 parser1       : Parser,
-                 parser2       : Optional[Parser] = None,
-                 match_indices : Optional[Tuple[Tuple[int, int], Tuple[int, int]]] = None):
+                 parser1          : Parser,
+                 parser2          : Optional[Parser] = None,
+                 match_indices    : Optional[Tuple[Tuple[int, int], Tuple[int, int]]] = None,
+                 search           : Optional[Callable[[], Any]] = None,
+                 max_alternatives : int = 4):
 
         self.parsers = [parser1]
         if parser2: self.parsers.append(parser2)
 
-        self.parser_index  = 0
-        self.match_indices = match_indices
-        self.ply_index     = 0
-        self.square_size   = 80
-        self.ts            = datetime.now().strftime('%b %d, %Y at %-I:%M %p')
-        self.root          = tk.Tk()
-        self.frame         = tk.Frame(self.root)
-        self.canvas        = tk.Canvas(self.root, width = self.square_size * 8, height = self.square_size * 8)
-        self.labels        = [tk.Label(self.root, font = ("Menlo", 20, "bold")),
-                              tk.Label(self.root, font = ("Menlo", 14, "italic")),
-                              tk.Label(self.root, font = ("Menlo", 12, "bold")),
-                              tk.Label(self.root, font = ("Menlo", 12))]
+        self.parser_index     = 0
+        self.match_indices    = list(match_indices) if match_indices else [(0, 0)] * len(self.parsers)
+        self.ply_index        = 0
+        self.square_size      = 80
+        self.ts               = datetime.now().strftime('%b %d, %Y at %-I:%M %p')
+        self.search           = search
+        self.max_alternatives = max_alternatives
+        self.moves            = []
+        self.executor         = ThreadPoolExecutor(max_workers = 2, thread_name_prefix = "Navigator")
+        self.futures          = {}
+        self.updates          = queue.Queue()
+        self.searching        = search is not None
+        self.polling          = False
+        self.error            = None
+        self.root             = tk.Tk()
+        self.frame            = tk.Frame(self.root)
+        self.canvas           = tk.Canvas(self.root, width = self.square_size * 8, height = self.square_size * 8)
+        self.labels           = [tk.Label(self.root, font = ("Menlo", 20, "bold")),
+                                 tk.Label(self.root, font = ("Menlo", 14, "italic")),
+                                 tk.Label(self.root, font = ("Menlo", 12, "bold")),
+                                 tk.Label(self.root, font = ("Menlo", 12)),
+                                 tk.Label(self.root, font = ("Menlo", 12, "italic"))]
 
         self.props = {"⇤": {"side": "left",  "key": "<Up>",    "action": lambda: 0,                                       "condition": lambda: self.ply_index    == 0},
                       "←": {"side": "left",  "key": "<Left>",  "action": lambda: max(self.ply_index - 1, 0),              "condition": lambda: self.ply_index    == 0},
@@ -62,11 +97,12 @@ class Navigator:
     
     @property
     def active_indices(self):
-        return self.match_indices[0] if self.parser_index == 0 else self.match_indices[1]
+        return self.match_indices[self.parser_index]
 
     @property
     def end_index(self):
-        return len(self.parsers[self.parser_index].positions) - 1
+        parser = self.parsers[self.parser_index]
+        return len(parser.positions) - 1 if parser else 0
     
     def create_buttons(self):
         '''
@@ -80,23 +116,123 @@ class Navigator:
             buttons.append(tk.Button(self.frame if k in ["↣", "↪", "↛"] else self.root, 
                                 text = k, font = ("Menlo", 30), command = lambda i=i: self.update_ply_index(i)))
         return buttons
+
+    def run_search(self):
+        '''
+        Runs on the executor. Builds the Dagger, which loads the dataset, then posts the learning moment and each best 
+        move to the updates queue as the search finds them. Any error is posted as well, so poll can report it.
+        '''
+
+        try:
+            dagger = self.search()
+            self.updates.put(("moment", dagger.best_index))
+
+            for best_move in dagger.search_steps():
+                if not self.searching:
+                    break
+                self.updates.put(("move", best_move))
+
+        except Exception as error:
+            self.updates.put(("error", error))
+
+        self.updates.put(("done", None))
+
+    def prefetch(self, index: int):
+        '''
+        Starts building the Parsers of the alternative at index and of the one after it, which is where toggle_parser 
+        switches to next, unless they are already built or being built. The uploaded game at index 0 is always built, 
+        so it is never submitted.
+        '''
+
+        for i in {index, (index + 1) % len(self.parsers)}:
+            if self.parsers[i] is None and i not in self.futures:
+                self.futures[i] = self.executor.submit(Parser, self.moves[i - 1]['pgn'], False)
+
+        if self.futures and not self.polling:
+            self.polling = True
+            self.root.after(100, self.poll)
+
+    def poll(self):
+        '''
+        Runs on the tkinter thread every 100 milliseconds until the search has finished and every Parser it started 
+        has been built. Each new best move becomes an alternative, at most max_alternatives of them and one per game, 
+        and each finished Parser is put in place, redrawing the board if it is the one on screen.
+        '''
+
+        while not self.updates.empty():
+            message, payload = self.updates.get()
+
+            if message == "moment":
+                self.match_indices[0] = (payload, payload)
+
+            elif message == "move":
+                if len(self.moves) < self.max_alternatives and payload['game_id'] not in {move['game_id'] for move in self.moves}:
+                    self.moves.append(payload)
+                    self.parsers.append(None)
+                    self.match_indices.append((payload['ply'], payload['ply']))
+                    self.prefetch(self.parser_index)
+
+            elif message == "error":
+                self.error = f"Search failed: {payload}"
+
+            elif message == "done":
+                self.searching = False
+
+        redraw = False
+        for i, future in [(i, future) for i, future in self.futures.items() if future.done()]:
+            del self.futures[i]
+
+            # A failed build is left as None, so prefetch retries it the next time its neighbour is shown
+            if future.exception() is not None:
+                self.error = f"Alternative {i} could not be loaded: {future.exception()}"
+                continue
+
+            self.parsers[i] = future.result()
+            redraw = redraw or i == self.parser_index
+
+        built = sum(parser is not None for parser in self.parsers[1:])
+        self.labels[4].config(text = self.error or f"{'Searching... ' if self.searching else ''}{len(self.moves)} alternatives found, {built} ready")
+
+        if redraw:
+            self.display_position()
+        else:
+            self.update_states()
+
+        self.polling = self.searching or bool(self.futures)
+        if self.polling:
+            self.root.after(100, self.poll)
+
+    def close(self):
+        '''
+        Stops the search after its current step, cancels any Parser that has not started building and closes the window.
+        '''
+
+        self.searching = False
+        self.executor.shutdown(wait = False, cancel_futures = True)
+        self.root.destroy()
     
     def toggle_parser(self):
         '''
         Switches between the Parser objects in the parsers list and ensures an invalid ply_index isn't used upon switching.
         
         The parser_index is incremented and wrapped around the length of the parsers list to achieve this. If the current 
-        ply_index is beyond the end_index of the new active Parser, it is adjusted to that Parser's final ply.
+        ply_index is beyond the end_index of the new active Parser, it is adjusted to that Parser's final ply. The 
+        alternatives next to the new one are prefetched, so the following switch is instant as well.
         '''
 
         self.parser_index = (self.parser_index + 1) % len(self.parsers)
-        if self.ply_index > self.end_index: self.ply_index = self.end_index
+        if self.parsers[self.parser_index] and self.ply_index > self.end_index: self.ply_index = self.end_index
+        if self.moves: self.prefetch(self.parser_index)
         return self.ply_index
     
     def update_ply_index(self, i: int):
         '''
-        Updates the current index based on the button pressed and displays the new position.
+        Updates the current index based on the button pressed and displays the new position. Key presses are ignored while
+        their button is disabled, such as while an alternative is still loading.
         '''
+
+        if self.buttons[i].cget('state') == "disabled":
+            return
         
         self.ply_index = self.props[self.buttons[i].cget('text')]["action"]()
         self.display_position()
@@ -106,8 +242,11 @@ class Navigator:
         Updates the state of navigation buttons based on the current position index.
         '''
 
+        loading = self.parsers[self.parser_index] is None
+
         for i in self.buttons:
-            i.config(state = "disabled" if self.props[i.cget('text')]["condition"]() else "normal")
+            disabled = (loading and i.cget('text') != "↪") or self.props[i.cget('text')]["condition"]()
+            i.config(state = "disabled" if disabled else "normal")
 
     def draw_canvas(self, position: Position):
         '''
@@ -142,8 +281,9 @@ class Navigator:
         '''
 
         metadata = parser.metadata
+        title    = "Matched Game" if self.search is None else f"Alternative {self.parser_index} of {len(self.parsers) - 1}"
 
-        self.labels[0].config(text = f"Game Uploaded on {self.ts}" if self.parser_index == 0 else "Matched Game", pady = 10)
+        self.labels[0].config(text = f"Game Uploaded on {self.ts}" if self.parser_index == 0 else title, pady = 10)
         self.labels[1].config(text = f"{metadata.get('White', '')} vs. {metadata.get('Black', '')} ({metadata.get('Date', '').split('.')[0]})", pady = 0)
         self.labels[2].config(text = f"{position.move_number}. {position.move_notation}", pady = 10)
         self.labels[3].config(text = metadata.get('Result', '') if position.final_move else ("White to Move" if position.white_turn else "Black to Move"), pady = 10)
@@ -169,18 +309,31 @@ class Navigator:
         This method is called each time a navigation button is pressed to refresh the display.
         '''
 
-        parser   = self.parsers[self.parser_index]
-        position = parser.positions[self.ply_index]
+        parser = self.parsers[self.parser_index]
 
         self.canvas.delete("all")
-        self.draw_canvas(position)
-
         self.root.title("Navigator")
-        self.update_labels(parser, position)
+
+        # The alternative is still being built, and poll will call back here once it is ready
+        if parser is None:
+            self.labels[0].config(text = f"Alternative {self.parser_index} of {len(self.parsers) - 1}", pady = 10)
+            for label in self.labels[1:4]: label.config(text = "")
+            self.labels[2].config(text = "Loading...", pady = 10)
+        else:
+            position = parser.positions[min(self.ply_index, self.end_index)]
+            self.draw_canvas(position)
+            self.update_labels(parser, position)
+
         self.pack_components()
         self.update_states()
 
     def __call__(self):
 
+        if self.search is not None:
+            self.executor.submit(self.run_search)
+            self.polling = True
+            self.root.after(100, self.poll)
+
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
         self.display_position()
         self.root.mainloop()
\ No newline at end of file
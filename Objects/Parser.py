@@ -65,24 +65,29 @@ class Parser:
         marks if those positions were submitted by the user (optional).
 
         The method performs the following steps:
-            1. Iterate through the game, creating a Position object for each move using the Position.from_chess_board() method.
+            1. Iterate through the game, creating a Position object for each move, with bitboards replayed by Replayer.
             2. Set the move number, move notation (in SAN), and user submission status for each Position object.
             3. Return the list of positions.
+
+        The python-chess board is still pushed, since it provides the SAN notation and the FEN Stockfish evaluates, but the 
+        bitboards come from Replayer instead of rescanning all 64 squares with Position.get_bitboards after every move.
         '''
 
         board     = self.game.board()
+        replayer  = Replayer(Position.get_bitboards(board), board.turn)
         positions = [Position()]
 
         for i, move in enumerate(self.game.mainline_moves()):
             move_notation = board.san(move)
             board.push(move)
+            replayer.push(move.uci())
 
             move_number = (i // 2) + 1
             positions.append(Position(move_number   = move_number, 
                                       move_notation = move_notation, 
                                       white_turn    = board.turn,
                                       centipawn     = Position.evaluate_position(board),
-                                      bitboards     = Position.get_bitboards(board)))
+                                      bitboards     = replayer.to_dict()))
 
         positions[-1].final_move = True
         return positions
\ No newline at end of file
@@ -1,3 +1,4 @@
+from   Replayer  import *
 from   stockfish import Stockfish
 from   typing    import *
 import chess
@@ -107,32 +108,32 @@ class Position:
 
         return evaluation if evaluation else 0
 
-    def apply_move(self, move: Tuple[str, int, int]):
+    def apply_move(self, move: Union[str, int, Tuple[str, int, int]]):
         '''
-        move (Tuple):
-            piece       : a Unicode character representing the moving piece
-            origin      : an integer representing the origin square index (0-63)
-            destination : an integer representing the destination square index (0-63)
+        move (one of):
+            uci     : a move in UCI notation, such as "e2e4" or "e7e8q"
+            encoded : an integer produced by Replayer.encode
+            tuple   : (piece, origin, destination), where origin and destination are square indices (0-63)
 
         The method performs the following steps:
-            1. Create bitboards with a single bit set at the origin and destination squares.
-            2. Update the moving piece's bitboard by clearing the bit at the origin square and setting the bit at the destination square.
-            3. Loop over the opponent's pieces and update their bitboards by removing any captured piece from the destination square.
+            1. Convert the move to Replayer's integer encoding. A tuple carries no promotion, and its piece is not needed, 
+               since the moving piece is found on the origin square.
+            2. Replay the move with Replayer.apply, which moves the piece, removes any captured piece and handles castling,
+               en passant and promotion.
+            3. Store the result as a new dictionary rather than updating the existing one, since the default bitboards are
+               shared by every Position created without its own.
         '''
 
-        piece, origin, destination = move
-        origin_bitboard      = 1 << origin
-        destination_bitboard = 1 << destination
+        if isinstance(move, tuple):
+            _, origin, destination = move
+            move = origin | destination << 6
+        elif isinstance(move, str):
+            move = Replayer.encode(move)
 
-        self.bitboards[piece] ^= origin_bitboard | destination_bitboard
-
-        # If the loop detects that a capture has occurred, break the loop, since the move must therefore be complete
-        for opponent_piece in self.bitboards.keys():
-            if opponent_piece != piece:
-                if self.bitboards[opponent_piece] & destination_bitboard:
-                   self.bitboards[opponent_piece] &= ~destination_bitboard
-                   break
+        bitboards = [self.bitboards[piece] for piece in Replayer.pieces]
+        Replayer.apply(bitboards, move, self.white_turn)
 
+        self.bitboards  = dict(zip(Replayer.pieces, bitboards))
         self.white_turn = not self.white_turn
          
     def get_board(self) -> List[List[str]]:
@@ -0,0 +1,160 @@
+from   typing import *
+import numbers
+import numpy  as np
+
+class Replayer:
+    '''
+    The Replayer class replays whole games directly on bitboards, without building a python-chess Board or rescanning
+    all 64 squares after every move. It handles every special move: castling moves the rook as well as the king, en
+    passant removes the pawn behind the destination square, and promotion swaps the pawn for the promoted piece.
+
+    The 12 bitboards are kept as a list of plain Python integers, in the same order as the keys of Position.bitboards:
+    white pawn, rook, knight, bishop, queen and king, followed by the black pieces in the same order.
+
+    Attributes:
+        bitboards  (List[int]) : The 12 bitboards of the current position.
+        white_turn (bool)      : Whether or not it is white's turn to move.
+
+    Methods:
+        encode    : Packs a UCI move into a single integer.
+        decode    : Unpacks an encoded move into its origin, destination and promotion piece.
+        apply     : Applies an encoded move to a list of bitboards in place.
+        push      : Applies a UCI or encoded move to the current position.
+        replay    : Replays a whole game and returns the bitboards and board sum of every position in it.
+        to_dict   : Returns the current bitboards keyed by the same Unicode pieces as Position.bitboards.
+
+    Move Encoding:
+        An encoded move is origin | destination << 6 | promotion << 12, where the squares are 0 (a1) to 63 (h8) and the
+        promotion is 0 for none, or 1 to 4 for a knight, bishop, rook or queen. Encoding a game once lets it be
+        replayed without parsing any text, and the codes fit comfortably in an int16 column.
+    '''
+
+    pieces     = ['♙', '♖', '♘', '♗', '♕', '♔', '♟︎', '♜', '♞', '♝', '♛', '♚']
+    promotions = {'n': 1, 'b': 2, 'r': 3, 'q': 4}
+    start      = [0x000000000000FF00, 0x0000000000000081, 0x0000000000000042, 0x0000000000000024, 0x0000000000000008, 0x0000000000000010,
+                  0x00FF000000000000, 0x8100000000000000, 0x4200000000000000, 0x2400000000000000, 0x0800000000000000, 0x1000000000000000]
+
+    # The index in bitboards of each promotion code's piece, relative to the first piece of the moving side
+    promotion_offsets = {1: 2, 2: 3, 3: 1, 4: 4}
+
+    # King origin and destination mapped to the rook's origin and destination
+    castles = {(4, 6): (7, 5), (4, 2): (0, 3), (60, 62): (63, 61), (60, 58): (56, 59)}
+
+    def __init__(self,
+                 bitboards  : Optional[Union[List[int], Dict[str, int]]] = None,
+                 white_turn : bool = True):
+
+        if isinstance(bitboards, dict):
+            bitboards = [bitboards[piece] for piece in self.pieces]
+
+        self.bitboards  = list(bitboards) if bitboards is not None else list(self.start)
+        self.white_turn = white_turn
+
+    @classmethod
+    def encode(cls, uci: str) -> int:
+        '''
+        Packs a UCI move such as "e2e4" or "e7e8q" into a single integer.
+        '''
+
+        origin      = (ord(uci[0]) - 97) + (ord(uci[1]) - 49) * 8
+        destination = (ord(uci[2]) - 97) + (ord(uci[3]) - 49) * 8
+        promotion   = cls.promotions[uci[4]] if len(uci) > 4 else 0
+
+        return origin | destination << 6 | promotion << 12
+
+    @staticmethod
+    def decode(code: int) -> Tuple[int, int, int]:
+        return code & 63, (code >> 6) & 63, code >> 12
+
+    @classmethod
+    def apply(cls,
+              bitboards  : List[int],
+              code       : int,
+              white_turn : bool):
+        '''
+        Applies an encoded move to the 12 bitboards in place. The move is assumed to be legal, as it is for any move
+        read from a game record, so only the pieces of the side to move are searched for the moving piece.
+
+        The method performs the following steps:
+            1. Find the moving piece among the boards of the side to move, and move it from origin to destination.
+            2. Clear the destination square on every opposing board, which removes a captured piece if there is one.
+            3. Handle the special moves:
+                - A pawn moving diagonally onto an empty square captures en passant, removing the pawn behind it.
+                - A king moving two files castles, moving the matching rook to the other side of the king.
+                - A promotion removes the pawn from the destination square and places the promoted piece there.
+
+        The code is converted to a Python int first, since shifting a small NumPy integer past its width overflows.
+        '''
+
+        code        = int(code)
+        origin      = code & 63
+        destination = (code >> 6) & 63
+        promotion   = code >> 12
+        own         = 0 if white_turn else 6
+        opponent    = 6 - own
+        from_bit    = 1 << origin
+        to_bit      = 1 << destination
+
+        piece = own
+        while not bitboards[piece] & from_bit:
+            piece += 1
+
+        captured = False
+        for i in range(opponent, opponent + 6):
+            if bitboards[i] & to_bit:
+                bitboards[i] ^= to_bit
+                captured = True
+                break
+
+        bitboards[piece] ^= from_bit | to_bit
+
+        if piece == own:
+            if not captured and (origin - destination) & 7:
+                bitboards[opponent] &= ~(1 << (destination - 8 if white_turn else destination + 8))
+
+            if promotion:
+                bitboards[piece]                                   ^= to_bit
+                bitboards[own + cls.promotion_offsets[promotion]] |= to_bit
+
+        elif piece == own + 5 and (origin, destination) in cls.castles:
+            rook_origin, rook_destination = cls.castles[(origin, destination)]
+            bitboards[own + 1] ^= (1 << rook_origin) | (1 << rook_destination)
+
+    def push(self, move: Union[str, int]):
+        '''
+        Applies a UCI or encoded move to the current position and passes the turn to the other side. Encoded moves may be
+        Python or NumPy integers. A null move, "0000" in UCI or 0 when encoded, only passes the turn.
+        '''
+
+        if isinstance(move, str):
+            code = self.encode(move) if move != "0000" else 0
+        elif isinstance(move, numbers.Integral):
+            code = int(move)
+        else:
+            raise TypeError(f"A move must be a UCI string or an encoded integer, not {type(move).__name__}.")
+
+        if code:
+            self.apply(self.bitboards, code, self.white_turn)
+
+        self.white_turn = not self.white_turn
+
+    def replay(self, moves: Iterable[Union[str, int]]) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Replays a whole game from the current position.
+
+        Returns:
+            bitboards  : A (plies + 1, 12) uint64 array holding the bitboards of every position, starting position included.
+            board_sums : A (plies + 1,) uint64 array holding the board sum of every position.
+        '''
+
+        rows = [tuple(self.bitboards)]
+
+        for move in moves:
+            self.push(move)
+            rows.append(tuple(self.bitboards))
+
+        bitboards = np.array(rows, dtype = np.uint64)
+        return bitboards, bitboards.sum(axis = 1, dtype = np.uint64)
+
+    def to_dict(self) -> Dict[str, int]:
+        return dict(zip(self.pieces, self.bitboards))
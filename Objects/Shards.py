@@ -0,0 +1,343 @@
+from   Utilities                  import *
+from   multiprocessing.connection import Connection
+from   typing                     import *
+import multiprocessing            as mp
+import numpy                      as np
+import os
+import pandas                     as pd
+import pyarrow                    as pa
+import pyarrow.dataset            as ds
+import pyarrow.parquet            as pq
+import shutil
+
+def serve_shard(shard_path : str,
+                connection : Connection):
+    '''
+    The loop run by each worker process. The worker loads only its own shard, sorts it by board_sum and then answers
+    requests from the coordinator until it is told to stop.
+
+    Requests are (operation, payload) tuples:
+        ("lookup", board_sums) : Returns every row whose board_sum is in board_sums, as an Arrow table.
+        ("count",  None)       : Returns the number of rows held by the shard.
+        ("stop",   None)       : Ends the loop.
+
+    A worker never dies on a failed request. The exception is sent back in place of the reply and raised again by the 
+    coordinator, and if the shard itself could not be loaded, every later request is answered with that exception.
+    '''
+
+    try:
+        shard = ds.dataset(shard_path, format = "parquet").to_table().sort_by('board_sum').combine_chunks()
+        keys  = shard['board_sum'].to_numpy().astype(np.uint64)
+        error = None
+    except Exception as exception:
+        error = exception
+
+    while True:
+        operation, payload = connection.recv()
+
+        if operation == "stop":
+            connection.close()
+            break
+
+        if error is not None:
+            connection.send(error)
+            continue
+
+        try:
+            if operation == "lookup":
+                board_sums = np.asarray(payload, dtype = np.uint64)
+                starts     = np.searchsorted(keys, board_sums, side = 'left')
+                ends       = np.searchsorted(keys, board_sums, side = 'right')
+                rows       = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) if len(board_sums) else []
+                connection.send(shard.take(pa.array(rows, type = pa.int64())))
+
+            elif operation == "count":
+                connection.send(shard.num_rows)
+
+            else:
+                connection.send(ValueError(f"Unknown shard operation {operation!r}."))
+
+        except Exception as exception:
+            connection.send(exception)
+
+class Shards:
+    '''
+    The Shards class splits the position data into N shards by board_sum range and serves each shard from its own
+    worker process, so that no single process has to hold the whole dataset. Dagger sends its lookups to the shard that
+    owns each board_sum, and the rows that come back are merged into a single Arrow table.
+
+    Attributes:
+        storage    (Utility)          : The Utility whose Parquet dataset is sharded.
+        n_shards   (int)              : The number of shards, and therefore of worker processes.
+        max_depth  (int)              : The number of following centipawn values stored with each row.
+        path       (str)              : The directory holding the shard files and their manifest.
+        boundaries (np.ndarray)       : The sorted board_sum values where each shard after the first begins.
+        workers    (List[mp.Process]) : The worker processes, one per shard.
+        pipes      (List[Connection]) : The coordinator's end of the pipe to each worker.
+
+    Methods:
+        schema    : Returns the schema every shard file is written with.
+        write     : Writes the rows of a frame owned by each shard as one part file per shard.
+        partition : Splits the dataset into shard files, one Parquet fragment at a time.
+        annotate  : Adds next_board_sum and forward_centipawn columns to a frame of whole games.
+        append    : Routes the rows of newly ingested games to the shards that own them.
+        restamp   : Records the current dataset version in the manifest, once the shards are known to match it.
+        owners    : Returns the index of the shard that owns each board_sum.
+        start     : Starts one worker process per shard.
+        send      : Sends a request to a shard worker, failing if the worker has died.
+        receive   : Waits for the reply of a shard worker, failing if the worker has died or answered with an error.
+        lookup    : Scatters board_sum lookups to their owning shards and gathers the matching rows.
+        counts    : Returns the number of rows held by each shard.
+        close     : Stops the worker processes.
+
+    Partitioning:
+        Shard boundaries are taken from the quantiles of the board_sum column, so the shards hold roughly equal numbers
+        of rows even though board sums are far from uniformly distributed. Every row with a given board_sum lands in the
+        same shard, which means a lookup only ever touches a single worker.
+
+        A row on its own is not enough for Dagger, since the loss function reads the centipawn values of the plies that
+        follow it and the search moves on to the position after it, both of which may live in other shards. Each row is
+        therefore annotated with next_board_sum and forward_centipawn before it is written out. The dataset is read one
+        fragment at a time, and since it is partitioned by total_ply, every game is complete within its fragment.
+    '''
+
+    def __init__(self,
+                 storage   : Utility,
+                 n_shards  : int = 4,
+                 max_depth : int = 20):
+
+        self.storage    = storage
+        self.n_shards   = n_shards
+        self.max_depth  = max_depth
+        self.path       = os.path.join(os.path.dirname(storage.pq_path), 'Shards', storage.pq_name)
+        self.workers    = []
+        self.pipes      = []
+
+        manifest = self.storage.read_manifest(os.path.join(self.path, 'manifest.json'))
+        if (manifest.get("version"), manifest.get("n_shards"), manifest.get("max_depth")) != \
+           (storage.dataset_version(), n_shards,               max_depth):
+            manifest = self.partition()
+
+        self.boundaries = np.array(manifest["boundaries"], dtype = np.uint64)
+
+    @staticmethod
+    def annotate(frame     : pd.DataFrame,
+                 max_depth : int) -> pd.DataFrame:
+        '''
+        Adds the two columns a row needs to be scored and followed without the rest of its game:
+
+            next_board_sum    : The board_sum of the next ply in the same game, or null at the end of the game.
+            forward_centipawn : The centipawn values of this ply and up to max_depth - 1 following plies in the same game.
+
+        The frame must contain whole games. Rows are sorted by game_id and ply so that each game is a contiguous run.
+        '''
+
+        frame     = frame.sort_values(['game_id', 'ply'], kind = 'stable').reset_index(drop = True)
+        keys      = frame['board_sum'].to_numpy(dtype = np.uint64)
+        centipawn = frame['centipawn_evaluation'].to_numpy()
+        game_ids  = frame['game_id'].to_numpy()
+
+        game_ends   = Utility.game_ends(game_ids)
+        has_next    = np.arange(len(frame)) + 1 < game_ends
+
+        next_board_sum             = pd.array(np.roll(keys, -1), dtype = "UInt64")
+        next_board_sum[~has_next]  = pd.NA
+        frame['next_board_sum']    = next_board_sum
+        frame['forward_centipawn'] = [centipawn[i : min(i + max_depth, end)].tolist() for i, end in enumerate(game_ends)]
+
+        return frame
+
+    def schema(self) -> pa.Schema:
+        '''
+        Returns the schema of the dataset plus the two annotation columns. Every part file is written with it, so that
+        parts a shard owns no rows of still have typed columns, and each worker's shard reads as a single dataset.
+        '''
+
+        schema = ds.dataset(self.storage.dataset_files(), format = "parquet").schema.remove_metadata()
+
+        return schema.append(pa.field('next_board_sum',    pa.uint64())) \
+                     .append(pa.field('forward_centipawn', pa.list_(pa.float64())))
+
+    def write(self,
+              frame  : pd.DataFrame,
+              name   : str,
+              schema : pa.Schema):
+        '''
+        Writes the rows of an annotated frame owned by each shard as a part file called name in that shard's directory.
+        Columns the frame lacks are written as nulls.
+        '''
+
+        owners = self.owners(frame['board_sum'])
+        frame  = frame.reindex(columns = schema.names)
+
+        for shard in range(self.n_shards):
+            shard_path = os.path.join(self.path, f'shard={shard}')
+            os.makedirs(shard_path, exist_ok = True)
+            pq.write_table(pa.Table.from_pandas(frame[owners == shard], schema = schema, preserve_index = False),
+                           os.path.join(shard_path, f'{name}.parquet'))
+
+    def partition(self) -> Dict:
+        '''
+        Splits the dataset into n_shards shard directories and writes the manifest.
+
+        The method performs the following steps:
+            1. Read only the board_sum column and take its quantiles as the shard boundaries.
+            2. For each Parquet fragment, annotate its games and write the rows owned by each shard as a new part file.
+            3. Write the manifest, recording the dataset version the shards were built from.
+        '''
+
+        shutil.rmtree(self.path, ignore_errors = True)
+        os.makedirs(self.path)
+
+        dataset    = ds.dataset(self.storage.dataset_files(), format = "parquet")
+        keys       = np.sort(dataset.to_table(columns = ['board_sum'])['board_sum'].to_numpy().astype(np.uint64))
+        quantiles  = keys[(np.arange(1, self.n_shards) * len(keys)) // self.n_shards] if len(keys) else []
+        boundaries = [int(boundary) for boundary in quantiles]
+        self.boundaries = np.array(boundaries, dtype = np.uint64)
+
+        schema = self.schema()
+        for i, fragment in enumerate(dataset.get_fragments()):
+            self.write(self.annotate(fragment.to_table().to_pandas(), self.max_depth), f'part-{i}', schema)
+
+        manifest = {"version"   : self.storage.dataset_version(),
+                    "n_shards"  : self.n_shards,
+                    "max_depth" : self.max_depth,
+                    "boundaries": boundaries}
+
+        self.storage.write_manifest(os.path.join(self.path, 'manifest.json'), manifest)
+
+        return manifest
+
+    def append(self,
+               frame : pd.DataFrame,
+               name  : str):
+        '''
+        Routes the rows of newly ingested games to the shards that own them, writing one part file called name into each
+        shard, and then restamps the manifest. The boundaries are left as they are, so the existing shard files are not
+        touched. Running workers only see the new rows once they are restarted.
+        '''
+
+        self.write(self.annotate(frame, self.max_depth), name, self.schema())
+        self.restamp()
+
+    def restamp(self):
+        '''
+        Records the current dataset version in the manifest, so the shards are not rebuilt on the next start. This is
+        only correct when the shards already hold every row of the dataset, as they do after append or a compaction.
+        '''
+
+        manifest_path       = os.path.join(self.path, 'manifest.json')
+        manifest            = self.storage.read_manifest(manifest_path)
+        manifest["version"] = self.storage.dataset_version()
+
+        self.storage.write_manifest(manifest_path, manifest)
+
+    def owners(self, board_sums: Iterable[int]) -> np.ndarray:
+        '''
+        Returns the index of the shard that owns each board_sum. Shard k owns [boundaries[k - 1], boundaries[k]).
+        '''
+
+        return np.searchsorted(self.boundaries, np.asarray(board_sums, dtype = np.uint64), side = 'right')
+
+    def start(self) -> 'Shards':
+        '''
+        Starts one worker process per shard, each connected to the coordinator by its own pipe.
+        '''
+
+        for shard in range(self.n_shards):
+            coordinator_end, worker_end = mp.Pipe()
+            worker = mp.Process(target = serve_shard,
+                                args   = (os.path.join(self.path, f'shard={shard}'), worker_end),
+                                daemon = True)
+            worker.start()
+            self.workers.append(worker)
+            self.pipes.append(coordinator_end)
+
+        return self
+
+    def send(self,
+             shard     : int,
+             operation : str,
+             payload   : Any = None):
+        '''
+        Sends an (operation, payload) request to a shard worker, raising an error instead if the worker has died.
+        '''
+
+        try:
+            self.pipes[shard].send((operation, payload))
+        except (BrokenPipeError, ConnectionResetError):
+            raise RuntimeError(f"The worker for shard {shard} exited with code {self.workers[shard].exitcode}.")
+
+    def receive(self, shard: int) -> Any:
+        '''
+        Returns the next reply from a shard worker. The pipe is polled rather than read directly, so a worker that has
+        died raises an error instead of blocking the coordinator forever, and an exception sent back by the worker is
+        raised here.
+        '''
+
+        pipe, worker = self.pipes[shard], self.workers[shard]
+
+        while not pipe.poll(1.0):
+            if not worker.is_alive():
+                raise RuntimeError(f"The worker for shard {shard} exited with code {worker.exitcode}.")
+
+        try:
+            reply = pipe.recv()
+        except EOFError:
+            raise RuntimeError(f"The worker for shard {shard} closed its pipe.")
+
+        if isinstance(reply, Exception):
+            raise RuntimeError(f"The worker for shard {shard} failed.") from reply
+
+        return reply
+
+    def lookup(self, board_sums: Iterable[int]) -> pa.Table:
+        '''
+        Returns every row whose board_sum is in board_sums.
+
+        The lookups are grouped by owning shard and sent to all of those shards before any reply is read, so the
+        workers search their slices in parallel. The replies are then gathered and concatenated.
+        '''
+
+        if not self.workers:
+            self.start()
+
+        board_sums = np.unique(np.asarray(list(board_sums), dtype = np.uint64))
+        owners     = self.owners(board_sums)
+        targets    = np.unique(owners)
+
+        for shard in targets:
+            self.send(shard, "lookup", board_sums[owners == shard])
+
+        replies = [self.receive(shard) for shard in targets]
+
+        return pa.concat_tables(replies) if replies else pa.table({})
+
+    def counts(self) -> List[int]:
+        '''
+        Returns the number of rows held by each shard, which shows how evenly the boundaries split the data.
+        '''
+
+        if not self.workers:
+            self.start()
+
+        for shard in range(self.n_shards):
+            self.send(shard, "count")
+
+        return [self.receive(shard) for shard in range(self.n_shards)]
+
+    def close(self):
+
+        for pipe, worker in zip(self.pipes, self.workers):
+            if worker.is_alive():
+                pipe.send(("stop", None))
+            worker.join()
+
+        self.workers = []
+        self.pipes   = []
+
+    def __enter__(self) -> 'Shards':
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,230 @@
+from   Position  import *
+from   Replayer  import *
+from   Utilities import *
+from   typing    import *
+import chess.pgn
+import io
+import numpy             as np
+import os
+import pandas            as pd
+import pyarrow.dataset   as ds
+
+class Store:
+    '''
+    The Store class keeps every position of the dataset in a fixed-width binary file: a NumPy structured array behind a
+    small header. Loading it is a single np.memmap call, with nothing to decompress or decode, so it is ready as soon as
+    the process starts. Pages are only read from disk once a query touches them, and every process that maps the file
+    shares the same copy through the OS page cache.
+
+    Attributes:
+        storage (Utility)   : The Utility whose dataset is exported.
+        path    (str)       : The path to the binary file.
+        rows    (np.memmap) : The memory-mapped positions, one record per row of the dataset.
+
+    Methods:
+        read_header  : Reads the header of the binary file, if there is one.
+        encode       : Turns a frame of whole games into position records.
+        write_header : Writes the header at the start of an open binary file.
+        export       : Writes the base dataset to the binary file, one Parquet fragment at a time.
+        append       : Appends the records of a delta file to the binary file.
+        load         : Memory-maps the positions, after exporting or appending whatever parts of the dataset are missing.
+
+    Layout:
+        The file starts with a header of header_size bytes, which keeps the records page aligned:
+            magic           : The bytes b'GAMBITPS', which identify the file.
+            schema_version  : The version of the record layout. Files written with any other version are re-exported.
+            record_size     : The size of one record in bytes.
+            n_rows          : The number of records.
+            base_version    : The fingerprint of the base files the file was exported from.
+            n_deltas        : The number of delta files appended after the base records, oldest first.
+            deltas_version  : The fingerprint of those delta files.
+
+        Each record holds:
+            bitboards : The 12 bitboards of the position, in the same order as Position.bitboards.
+            board_sum : The position hash, as stored in the dataset.
+            centipawn : The centipawn evaluation, or NaN where the dataset has none.
+            ply       : The ply of the position within its game.
+            game_id   : The game the position belongs to.
+            next_row  : The record of the following ply in the same game, or -1 at the end of the game.
+
+        Records are in the same order as the rows of Utility.read_arrow, so row numbers from the position index can be
+        used on either. The bitboards are not stored in the dataset, so the export replays each game with Replayer.
+
+    Scope:
+        The class is an export and a loader only. Dagger, the shards and the aggregate table still read the dataset
+        through Utility.read_arrow and the position index, and the records are left to tools that need the bitboards or
+        the next_row links without parsing any pgn.
+
+    Updates:
+        Like the position index, the file follows the layout of the dataset: the base records come first, followed by
+        the records of each delta file. Ingesting games only appends the records of the new delta, and only a change to
+        the base files, as made by a compaction, exports the whole file again.
+
+    Ply Numbering:
+        Both the base dataset built by Dev Scripts/add_centipawn.py and the games added by Ingestor start at ply 0 for
+        the position after the first move. The export checks the board sum of every replayed position against the stored
+        hash, and fails on a game that does not match, rather than storing the wrong boards.
+    '''
+
+    magic          = b'GAMBITPS'
+    schema_version = 2
+    header_size    = 4096
+    columns        = ['game_id', 'ply', 'board_sum', 'centipawn_evaluation', 'pgn']
+    header_dtype   = np.dtype([('magic',           'S8'),
+                               ('schema_version',  '<u4'),
+                               ('record_size',     '<u4'),
+                               ('n_rows',          '<u8'),
+                               ('base_version',    'S16'),
+                               ('n_deltas',        '<u4'),
+                               ('deltas_version',  'S16')])
+    dtype          = np.dtype([('bitboards',       '<u8', (12,)),
+                               ('board_sum',       '<u8'),
+                               ('centipawn',       '<f4'),
+                               ('ply',             '<i4'),
+                               ('game_id',         '<i8'),
+                               ('next_row',        '<i8')])
+
+    def __init__(self, storage: Utility):
+
+        self.storage = storage
+        self.path    = storage.store_path
+        self.rows    = self.load()
+
+    def read_header(self) -> Optional[np.void]:
+        '''
+        Returns the header of the binary file, or None if the file is missing or was not written by this class.
+        '''
+
+        if not os.path.exists(self.path):
+            return None
+
+        with open(self.path, 'rb') as store_file:
+            header = np.frombuffer(store_file.read(self.header_dtype.itemsize), dtype = self.header_dtype)
+
+        return header[0] if len(header) and header[0]['magic'] == self.magic else None
+
+    @classmethod
+    def encode(cls,
+               frame  : pd.DataFrame,
+               offset : int) -> np.ndarray:
+        '''
+        Turns a frame of whole games, in dataset order, into position records. offset is the number of records written
+        before this frame, which next_row is relative to.
+
+        Each game's pgn is parsed once and replayed with Replayer, and each row takes the bitboards of the position after
+        move ply + 1, whose board sum must match the stored hash. The next row of each position is
+        found by sorting the rows by game_id and ply, so it does not depend on the rows of a game being contiguous.
+        '''
+
+        records              = np.zeros(len(frame), dtype = cls.dtype)
+        records['board_sum'] = frame['board_sum'].to_numpy(dtype = np.uint64)
+        records['centipawn'] = frame['centipawn_evaluation'].to_numpy(dtype = float, na_value = np.nan)
+        records['ply']       = frame['ply'].to_numpy()
+        records['game_id']   = frame['game_id'].to_numpy()
+        records['next_row']  = -1
+
+        for game_id, game_rows in frame.groupby('game_id', sort = False).indices.items():
+            game      = chess.pgn.read_game(io.StringIO(frame['pgn'].iloc[game_rows[0]]))
+            board     = game.board()
+            bitboards, board_sums = Replayer(Position.get_bitboards(board), board.turn).replay(move.uci() for move in game.mainline_moves())
+            positions             = records['ply'][game_rows] + 1
+
+            if positions.max() >= len(board_sums) or not np.array_equal(board_sums[positions], records['board_sum'][game_rows]):
+                raise ValueError(f"The replayed positions of game {game_id} do not match its stored board sums.")
+
+            records['bitboards'][game_rows] = bitboards[positions]
+
+        order     = np.lexsort((records['ply'], records['game_id']))
+        follows   = (records['game_id'][order[1:]] == records['game_id'][order[:-1]]) & \
+                    (records['ply'][order[1:]]     == records['ply'][order[:-1]] + 1)
+        records['next_row'][order[:-1][follows]] = order[1:][follows] + offset
+
+        return records
+
+    def write_header(self,
+                     store_file : BinaryIO,
+                     n_rows     : int,
+                     n_deltas   : int):
+        '''
+        Writes the header for n_rows records, covering the base files and the first n_deltas delta files.
+        '''
+
+        header = np.array([(self.magic, self.schema_version, self.dtype.itemsize, n_rows,
+                            self.storage.fingerprint(self.storage.base_files()).encode(), n_deltas,
+                            self.storage.fingerprint(self.storage.delta_files()[:n_deltas]).encode())],
+                          dtype = self.header_dtype)
+
+        store_file.seek(0)
+        store_file.write(header.tobytes())
+
+    def export(self):
+        '''
+        Writes the base dataset to the binary file.
+
+        The method performs the following steps:
+            1. Write a placeholder header, followed by the records of each Parquet fragment, which holds whole games.
+            2. Rewrite the header with the final number of records and the fingerprint of the base files.
+            3. Replace the old file with a single rename, so processes that still map it are unaffected.
+        '''
+
+        dataset = ds.dataset(self.storage.base_files(), format = "parquet")
+        n_rows  = 0
+
+        os.makedirs(os.path.dirname(self.path), exist_ok = True)
+        with open(f'{self.path}.tmp', 'wb') as store_file:
+            store_file.write(bytes(self.header_size))
+
+            for fragment in dataset.get_fragments():
+                records = self.encode(fragment.to_table(columns = self.columns).to_pandas(), n_rows)
+                store_file.write(records.tobytes())
+                n_rows += len(records)
+
+            self.write_header(store_file, n_rows, 0)
+
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def append(self, delta_file: str):
+        '''
+        Appends the records of the next delta file after the existing records, then rewrites the header to cover them.
+        The cost depends only on the size of the delta. Processes that already map the file keep seeing the records they
+        mapped, since nothing before the end of the file is moved.
+        '''
+
+        header  = self.read_header()
+        n_rows  = int(header['n_rows'])
+        records = self.encode(ds.dataset([delta_file], format = "parquet").to_table(columns = self.columns).to_pandas(), n_rows)
+
+        with open(self.path, 'r+b') as store_file:
+            store_file.seek(self.header_size + n_rows * self.dtype.itemsize)
+            store_file.write(records.tobytes())
+            store_file.truncate()
+            self.write_header(store_file, n_rows + len(records), int(header['n_deltas']) + 1)
+
+    def load(self) -> np.memmap:
+        '''
+        Memory-maps the records read-only. The whole file is exported again if it is missing, was written with a
+        different schema version or record size, or was exported from different base files or deltas. Otherwise only
+        the delta files written since the last load are appended.
+        '''
+
+        header      = self.read_header()
+        delta_files = self.storage.delta_files()
+
+        if header is None                                                                                  or \
+           header['schema_version'] != self.schema_version                                                 or \
+           header['record_size']    != self.dtype.itemsize                                                 or \
+           header['base_version']   != self.storage.fingerprint(self.storage.base_files()).encode()        or \
+           header['n_deltas']       >  len(delta_files)                                                    or \
+           header['deltas_version'] != self.storage.fingerprint(delta_files[:header['n_deltas']]).encode():
+            self.export()
+            header = self.read_header()
+
+        for delta_file in delta_files[header['n_deltas']:]:
+            self.append(delta_file)
+
+        header = self.read_header()
+
+        if header['n_rows'] == 0:
+            return np.zeros(0, dtype = self.dtype)
+
+        return np.memmap(self.path, dtype = self.dtype, mode = 'r', offset = self.header_size, shape = (int(header['n_rows']),))
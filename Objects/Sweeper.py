@@ -0,0 +1,195 @@
+from   Dagger    import *
+from   Parser    import *
+from   Utilities import *
+from   typing    import *
+import itertools
+import multiprocessing as mp
+import numpy           as np
+import pandas          as pd
+import pyarrow.compute as pc
+import time
+import warnings
+
+# Each worker process keeps one Dagger per dataset, so the memory-mapped dataset and the position index are loaded once
+worker_daggers = {}
+
+def sweep_game(storage     : Utility,
+               pgn_input   : str,
+               is_file     : bool,
+               lambdas     : np.ndarray,
+               depths      : np.ndarray,
+               preferences : List[str]) -> Dict:
+    '''
+    Scores one test game over the whole grid. Runs inside a worker process, or in the calling process when the sweep
+    has a single worker.
+
+    Returns a dictionary holding the metric tensors of Sweeper.score, or None for each of them if the learning moment of
+    the game matched no position in the dataset, along with the seconds spent loading, parsing, gathering and scoring.
+    '''
+
+    timings = {"load": 0.0}
+    start   = time.perf_counter()
+    parser  = Parser(pgn_input, is_file)
+    timings["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if storage.pq_path not in worker_daggers:
+        worker_daggers[storage.pq_path] = Dagger(storage, parser)
+        timings["load"] = time.perf_counter() - start
+
+    # The same steps as Dagger.__init__, without reloading the dataset, and with room for the deepest grid point
+    worker_dagger             = worker_daggers[storage.pq_path]
+    worker_dagger.depth       = int(depths.max())
+    worker_dagger.user_parser = parser
+    worker_dagger.user_board_sum, worker_dagger.user_centipawn, worker_dagger.best_index = worker_dagger.find_best_learning_moment()
+
+    start      = time.perf_counter()
+    candidates = worker_dagger.candidates(worker_dagger.user_board_sum)
+    forward    = worker_dagger.forward_values(candidates)
+    results    = pc.struct_field(pc.extract_regex(candidates['pgn'], r'\[Result "(?P<result>[^"]+)"\]'), [0]) \
+                   .to_numpy(zero_copy_only = False) if candidates.num_rows else np.array([])
+    timings["gather"] = time.perf_counter() - start
+
+    start   = time.perf_counter()
+    metrics = Sweeper.score(forward, results, worker_dagger.user_centipawn or 0, lambdas, depths, preferences) \
+              if candidates.num_rows else dict.fromkeys(["loss", "forward", "outcome"])
+    timings["score"] = time.perf_counter() - start
+
+    return {**metrics, "candidates": candidates.num_rows, "timings": timings}
+
+class Sweeper:
+    '''
+    The Sweeper class tunes the parameters of Dagger's loss function. Instead of rerunning the whole search once per
+    setting, it loads the dataset once per worker, gathers the candidates of each test game once, and scores every
+    combination of user_preference, lambda_reg and depth against them as a single array operation.
+
+    Attributes:
+        storage     (Utility)     : The Utility whose dataset Dagger searches.
+        lambdas     (np.ndarray)  : The values of lambda_reg to try.
+        depths      (np.ndarray)  : The values of depth to try.
+        preferences (List[str])   : The values of user_preference to try.
+        n_workers   (int)         : The number of worker processes the test games are spread over.
+        timings     (Dict)        : The seconds spent in each stage of the last sweep, summed over every worker.
+
+    Methods:
+        score    : Scores one game's candidates under every grid point at once.
+        __call__ : Sweeps a batch of test games and returns one row of results per grid point.
+
+    Scope:
+        Only the first step of the search is swept, the one taken from each game's learning moment. Every grid point
+        shares that step's candidates, whereas later steps depend on the move each grid point chose, so sweeping them
+        would mean one search per grid point again.
+
+    Metrics:
+        For every grid point, the candidate the search would have chosen is scored by
+            loss    : Its value under the loss function.
+            forward : Its mean forward centipawn value, seen from the preferred side.
+            outcome : The result of its game for the preferred side: 1 for a win, 0.5 for a draw and 0 for a loss.
+        and each metric is averaged over the test games whose learning moment matched any position in the dataset.
+    '''
+
+    def __init__(self,
+                 storage     : Utility,
+                 lambdas     : Iterable[float] = (0.0, 0.001, 0.01, 0.1, 1.0),
+                 depths      : Iterable[int]   = (1, 5, 10, 15, 20),
+                 preferences : Iterable[str]   = ("white", "black"),
+                 n_workers   : int             = mp.cpu_count()):
+
+        self.storage     = storage
+        self.lambdas     = np.asarray(list(lambdas), dtype = float)
+        self.depths      = np.asarray(list(depths),  dtype = int)
+        self.preferences = list(preferences)
+        self.n_workers   = n_workers
+        self.timings     = {}
+
+    @staticmethod
+    def score(forward        : np.ndarray,
+              results        : np.ndarray,
+              user_centipawn : float,
+              lambdas        : np.ndarray,
+              depths         : np.ndarray,
+              preferences    : List[str]) -> Dict[str, np.ndarray]:
+        '''
+        Applies Dagger.loss_function to every candidate under every grid point at once and picks the candidate with the
+        lowest loss for each grid point, the same way a search step would.
+
+        The forward values are read once at the largest depth. The mean at each smaller depth comes from prefix sums
+        over the columns, and the loss is then broadcast over a (preferences, lambdas, depths, candidates) array.
+
+        Returns:
+            A dictionary of (preferences, lambdas, depths) arrays holding the loss, forward and outcome of each choice.
+        '''
+
+        valid  = ~np.isnan(forward)
+        sums   = np.cumsum(np.where(valid, forward, 0), axis = 1)[:, depths - 1]
+        counts = np.cumsum(valid, axis = 1)[:, depths - 1]
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            means = (sums / counts).T
+
+        signs = np.array([1 if preference != "black" else -1 for preference in preferences], dtype = float)
+        pred  = signs[:, None, None, None] * means[None, None, :, :]
+        loss  = (pred - user_centipawn) ** 2 / depths[None, None, :, None] + lambdas[None, :, None, None] * pred ** 2
+        loss  = np.where(np.isnan(loss), np.inf, loss)
+
+        # np.argmin returns the first of several equal losses, as the heap in Dagger.search_step does
+        chosen  = np.argmin(loss, axis = -1)
+        points  = np.take_along_axis(loss, chosen[..., None], axis = -1)[..., 0]
+        picked  = np.take_along_axis(np.broadcast_to(pred, loss.shape), chosen[..., None], axis = -1)[..., 0]
+
+        white   = np.select([results == "1-0", results == "1/2-1/2", results == "0-1"], [1.0, 0.5, 0.0], np.nan)
+        outcome = np.stack([white if preference != "black" else 1 - white for preference in preferences])
+
+        return {"loss"    : np.where(np.isinf(points), np.nan, points),
+                "forward" : picked,
+                "outcome" : np.take_along_axis(np.broadcast_to(outcome[:, None, None, :], loss.shape), chosen[..., None], axis = -1)[..., 0]}
+
+    def __call__(self,
+                 pgn_inputs : Iterable[str],
+                 is_file    : bool = True) -> pd.DataFrame:
+        '''
+        Sweeps a batch of test games over the whole grid.
+
+        The method performs the following steps:
+            1. Spread the test games over n_workers processes, each of which maps the dataset once. Any stale IPC copy or
+               index segment is rebuilt beforehand in the calling process, rather than by every worker at once.
+            2. In each worker, parse a game, gather the candidates of its learning moment and score them with score.
+            3. Average each metric over the games that matched, and record the time spent in each stage.
+
+        Returns:
+            A DataFrame with one row per grid point, sorted from the best mean outcome to the worst.
+        '''
+
+        start = time.perf_counter()
+        tasks = [(self.storage, pgn_input, is_file, self.lambdas, self.depths, self.preferences) for pgn_input in pgn_inputs]
+
+        if self.n_workers > 1:
+            # Bring the IPC copy and the position index up to date here, so the workers only map files that already exist
+            self.storage.read_arrow()
+            Index(self.storage)
+
+            with mp.Pool(self.n_workers) as pool:
+                games = pool.starmap(sweep_game, tasks)
+        else:
+            games = list(itertools.starmap(sweep_game, tasks))
+
+        matched = [game for game in games if game["candidates"]]
+        shape   = (len(self.preferences), len(self.lambdas), len(self.depths))
+        grid    = pd.MultiIndex.from_product([self.preferences, self.lambdas, self.depths],
+                                             names = ["user_preference", "lambda_reg", "depth"])
+        results = pd.DataFrame(index = grid)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for metric in ["loss", "forward", "outcome"]:
+                values          = np.stack([game[metric] for game in matched]) if matched else np.full((1,) + shape, np.nan)
+                results[metric] = np.nanmean(values, axis = 0).ravel()
+
+        results["games"]   = len(games)
+        results["matched"] = len(matched)
+
+        self.timings         = {stage: sum(game["timings"][stage] for game in games) for stage in ["load", "parse", "gather", "score"]}
+        self.timings["wall"] = time.perf_counter() - start
+
+        return results.reset_index().sort_values(["outcome", "loss"], ascending = [False, True], ignore_index = True)
@@ -1,8 +1,14 @@
 from   tkinter import filedialog
 from   typing  import *
+import hashlib
+import json
 import os
 import sys
+import tempfile
+import numpy           as np
 import pandas          as pd
+import pyarrow         as pa
+import pyarrow.dataset as ds
 import pyarrow.parquet as pq
 
 class Utility:
@@ -11,15 +17,32 @@ class Utility:
     Parquet files, and provides convenience methods for managing Parquet datasets.
 
     Attributes:
-        pq_name  (str) : The name of the Parquet dataset.
-        pq_path  (str) : The path to the Parquet dataset.
-        pgn_path (str) : The path to the PGN file.
+        pq_name    (str) : The name of the Parquet dataset.
+        pq_path    (str) : The path to the Parquet dataset.
+        pgn_path   (str) : The path to the PGN file.
+        delta_path (str) : The path to the versioned delta files appended to the dataset since its last compaction.
+        index_path (str) : The path to the position index files for the base dataset and each delta.
+        arrow_path (str) : The path to the uncompressed Arrow IPC copies of the base dataset and each delta that Dagger memory-maps.
+        store_path (str) : The path to the fixed-width binary position file that Store memory-maps.
 
     Methods:
-        open_file    : Opens a file dialog and returns the selected file path as a string.
-        from_parquet : Reads a set of partitions from the Parquet dataset and returns them as a DataFrame. 
-        get_metadata : Retrieves the metadata for each partition in the Parquet dataset.
-        __call__     : Returns the path to the PGN file, which is obtained either from the command line arguments or a file dialog.
+        open_file       : Opens a file dialog and returns the selected file path as a string.
+        base_files      : Returns the Parquet files of the base dataset, in a stable order.
+        delta_files     : Returns the delta Parquet files, oldest first.
+        dataset_files   : Returns the base files followed by the delta files, which together make up the dataset.
+        fingerprint     : Returns a fingerprint of a list of files that changes whenever any of them change.
+        dataset_version : Returns the fingerprint of every file in the dataset.
+        parts           : Returns the name and files of the base part and of each delta part of the dataset.
+        remove_stale    : Removes the files a derived structure keeps for parts that no longer exist.
+        read_manifest   : Reads a JSON manifest, if there is one.
+        write_manifest  : Writes a JSON manifest.
+        game_ends       : Returns the row where each row's game ends, for rows in which every game is contiguous.
+        read_arrow_part : Returns one part of the dataset as a memory-mapped Arrow table, rewriting its IPC copy if it is stale.
+        read_arrow      : Returns the dataset as a memory-mapped Arrow table made of one IPC copy per part.
+        arrow_version   : Returns the fingerprint an IPC copy was written from.
+        from_parquet    : Reads a set of partitions from the Parquet dataset and returns them as a DataFrame. 
+        get_metadata    : Retrieves the metadata for each partition in the Parquet dataset.
+        __call__        : Returns the path to the PGN file, which is obtained either from the command line arguments or a file dialog.
     '''
 
     def __init__(self, pq_name: str = "Storage"):
@@ -46,6 +69,210 @@ class Utility:
 
         return file_path
 
+    @property
+    def delta_path(self) -> str:
+        return os.path.join(os.path.dirname(self.pq_path), 'Deltas', self.pq_name)
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(os.path.dirname(self.pq_path), 'Index', self.pq_name)
+
+    @property
+    def arrow_path(self) -> str:
+        return os.path.join(os.path.dirname(self.pq_path), 'Arrow', self.pq_name)
+
+    @property
+    def store_path(self) -> str:
+        return os.path.join(os.path.dirname(self.pq_path), 'Store', f'{self.pq_name}.bin')
+
+    def base_files(self) -> List[str]:
+        '''
+        Returns every Parquet file under pq_path, sorted by path. Files and directories starting with "_" or "." are 
+        skipped, matching the files pyarrow itself ignores when discovering a dataset.
+        '''
+
+        base_files = []
+
+        for directory, subdirectories, files in os.walk(self.pq_path):
+            subdirectories[:] = [name for name in subdirectories if not name.startswith(('_', '.'))]
+            base_files.extend(os.path.join(directory, name) for name in files 
+                              if name.endswith('.parquet') and not name.startswith(('_', '.')))
+
+        return sorted(base_files)
+
+    def delta_files(self) -> List[str]:
+        '''
+        Returns the delta Parquet files, oldest first. Delta files are numbered, so sorting by name sorts by version.
+        '''
+
+        if not os.path.isdir(self.delta_path):
+            return []
+
+        return sorted(os.path.join(self.delta_path, name) for name in os.listdir(self.delta_path) 
+                      if name.startswith('delta-') and name.endswith('.parquet'))
+
+    def dataset_files(self) -> List[str]:
+        '''
+        Returns the base files followed by the delta files. Reading them in this order keeps every game contiguous and
+        lets the position index address rows by their position in the concatenated dataset.
+        '''
+
+        return self.base_files() + self.delta_files()
+
+    @staticmethod
+    def fingerprint(files: List[str]) -> str:
+        '''
+        Returns a short fingerprint built from the path, size and modification time of each file. Any added, removed or 
+        rewritten file produces a new fingerprint, without the files themselves having to be read.
+        '''
+
+        fingerprint = hashlib.sha1()
+
+        for path in files:
+            stat = os.stat(path)
+            fingerprint.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+
+        return fingerprint.hexdigest()[:16]
+
+    def dataset_version(self) -> str:
+        '''
+        Returns the fingerprint of every file in the dataset, base and deltas alike. Derived structures such as the Dagger 
+        cache and the shards record this version, so they can detect that they are stale once new games are ingested.
+        '''
+
+        return self.fingerprint(self.dataset_files())
+
+    def parts(self) -> List[Tuple[str, List[str]]]:
+        '''
+        Returns the parts of the dataset in dataset_files order: 'base' with the base files, then one part per delta file,
+        named after it. The position index and the IPC copy keep one file per part, so ingesting games only adds a part.
+        '''
+
+        delta_files = self.delta_files()
+
+        return [('base', self.base_files())] + [(os.path.basename(path)[:-len('.parquet')], [path]) for path in delta_files]
+
+    def remove_stale(self,
+                     directory : str,
+                     extension : str):
+        '''
+        Removes every file in directory other than the <part><extension> file of each current part, such as the files 
+        left behind by deltas that have since been compacted. Temporary files are left alone, since they may belong to
+        a process that is still writing them.
+        '''
+
+        if not os.path.isdir(directory):
+            return
+
+        for stale in set(os.listdir(directory)) - {f'{name}{extension}' for name, _ in self.parts()}:
+            if not stale.endswith('.tmp'):
+                os.remove(os.path.join(directory, stale))
+
+    @staticmethod
+    def read_manifest(manifest_path: str) -> Dict:
+        '''
+        Returns the JSON manifest at manifest_path, or an empty dictionary if it has not been written yet.
+        '''
+
+        if not os.path.exists(manifest_path):
+            return {}
+
+        with open(manifest_path, "r") as manifest_file:
+            return json.load(manifest_file)
+
+    @staticmethod
+    def write_manifest(manifest_path : str,
+                       manifest      : Dict):
+        '''
+        Writes a manifest as JSON to manifest_path.
+        '''
+
+        with open(manifest_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+
+    @staticmethod
+    def game_ends(game_ids: np.ndarray) -> np.ndarray:
+        '''
+        Returns, for each row, the row where its game ends, which is the first row where the game_id changes. The rows
+        of every game must be contiguous.
+        '''
+
+        game_starts = np.flatnonzero(np.r_[True, game_ids[1:] != game_ids[:-1]])
+
+        return np.repeat(np.r_[game_starts[1:], len(game_ids)], np.diff(np.r_[game_starts, len(game_ids)]))
+
+    def read_arrow_part(self,
+                        name  : str,
+                        files : List[str]) -> pa.Table:
+        '''
+        Returns one part of the dataset as an Arrow table backed by a memory-mapped IPC file called name. The file records
+        the fingerprint of the Parquet files it was written from in its schema metadata, and is only rewritten, batch by 
+        batch, once that fingerprint no longer matches. The rewrite goes to a temporary file that replaces the old one in 
+        a single rename, so processes that still map the old file are unaffected.
+
+        Several processes may rewrite the same part at once, so each writes to a temporary file of its own. If the rename
+        fails because another process got there first, the file that process wrote is used instead.
+        '''
+
+        path        = os.path.join(self.arrow_path, f'{name}.arrow')
+        fingerprint = self.fingerprint(files).encode()
+
+        if self.arrow_version(path) == fingerprint:
+            return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+        os.makedirs(self.arrow_path, exist_ok = True)
+        dataset   = ds.dataset(files, format = "parquet")
+        schema    = dataset.schema.with_metadata({'version': fingerprint})
+        handle, temporary = tempfile.mkstemp(dir = self.arrow_path, prefix = f'{name}.', suffix = '.tmp')
+        os.close(handle)
+
+        try:
+            with pa.OSFile(temporary, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+                for batch in dataset.to_batches():
+                    writer.write_batch(batch)
+
+            os.replace(temporary, path)
+
+        except OSError:
+            if self.arrow_version(path) != fingerprint:
+                raise
+
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+        return pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+
+    @staticmethod
+    def arrow_version(path: str) -> Optional[bytes]:
+        '''
+        Returns the fingerprint recorded in the schema metadata of an IPC file, or None if the file is missing.
+        '''
+
+        if not os.path.exists(path):
+            return None
+
+        with pa.memory_map(path, 'r') as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+
+        return metadata.get(b'version')
+
+    def read_arrow(self) -> pa.Table:
+        '''
+        Returns the whole dataset as an Arrow table backed by memory-mapped IPC files, without decoding or copying it.
+
+        Parquet has to be decompressed into fresh memory by every process that reads it, whereas the uncompressed IPC 
+        files are mapped straight from the OS page cache, so concurrent processes share a single copy and pages are only
+        read once a query touches them. Like the position index, the copy has one part for the base files and one per
+        delta file, in dataset_files order, so ingesting games only writes the IPC file of the new delta. The parts are
+        concatenated without copying, and IPC files left behind by deltas that have since been compacted are removed.
+        '''
+
+        self.remove_stale(self.arrow_path, '.arrow')
+        tables = [self.read_arrow_part(name, files).replace_schema_metadata(None) for name, files in self.parts() if files]
+
+        return pa.concat_tables(tables) if tables else pa.table({})
+
     def __call__(self) -> str:
         '''
         Returns the path to the PGN file. If the path has not been set yet, it attempts to obtain it either from the 